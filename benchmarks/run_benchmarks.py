@@ -0,0 +1,210 @@
+import os
+import sys
+import time
+import calendar
+import argparse
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from pulp import PULP_CBC_CMD
+from scripts.utils.data_loader import load_data
+from scripts.utils.data_cache import load_data_cached
+from scripts.utils.params_loader import load_params
+from scripts.utils.normalizer import normalize_data
+from scripts.optimizations.battery_operation import BatteryOptimization
+from scripts.optimizations.matrix_model import DispatchLP
+from scripts.optimizations.rolling_horizon import RollingHorizon
+from scripts.optimizations.fast_dispatch import FastDispatch, DEFAULT_SOC_LEVELS
+from scripts.optimizations.decomposition import HorizonDecomposition
+from scripts.utils.calculate_profit import (
+    calculate_battery_profit, calculate_pv_profit, calculate_investment_costs,
+    calculate_effective_profit_buy, calculate_total_profit
+)
+
+# Times every pipeline stage (best of --repeat runs) and records its peak Python memory in a separate run under
+# tracemalloc. Model construction and solving are timed separately for every backend. Horizons longer than the
+# bundled year are built by repeating the year. CBC runs in a subprocess, so its memory is not included.
+
+
+def measure(function, repeat=1):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timings), peak / 2**20
+
+
+def measure_phases(model_run, optimizer, repeat=1):
+    # Best build / solve times of repeat runs, peak memory of one extra run under tracemalloc
+    best = {}
+    for _ in range(repeat):
+        timings = {'build': 0.0, 'solve': 0.0}
+        model_run(optimizer, timings)
+        best = {phase: min(seconds, best.get(phase, np.inf)) for phase, seconds in timings.items()}
+    tracemalloc.start()
+    model_run(optimizer, {'build': 0.0, 'solve': 0.0})
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak / 2**20
+
+
+def pulp_perfect_foresight(optimizer, timings):
+    optimizer._pulp_models.clear()  # Time the model build, not the reuse of the previous run's model
+    start = time.perf_counter()
+    model, _ = optimizer.build_pulp_model(0, len(optimizer.prices), optimizer.params['initial_soc'])
+    timings['build'] += time.perf_counter() - start
+    start = time.perf_counter()
+    model.solve(PULP_CBC_CMD(msg=False))
+    timings['solve'] += time.perf_counter() - start
+
+
+def pulp_day_ahead(optimizer, timings):
+    optimizer._pulp_models.clear()  # Windows reuse their model within a run, but not the previous run's models
+    time_steps = len(optimizer.prices)
+    soc = optimizer.params['initial_soc']
+    for start_step in range(0, time_steps, optimizer.commit_steps):
+        end = min(start_step + optimizer.horizon_steps, time_steps)
+        committed = min(optimizer.commit_steps, time_steps - start_step)
+        start = time.perf_counter()
+        model, variables = optimizer.build_pulp_model(start_step, end, soc, "DayAheadOptimization")
+        timings['build'] += time.perf_counter() - start
+        start = time.perf_counter()
+        model.solve(PULP_CBC_CMD(msg=False))
+        timings['solve'] += time.perf_counter() - start
+        soc = variables['soc'][committed].value()
+
+
+def highs_perfect_foresight(optimizer, timings):
+    start = time.perf_counter()
+    lp = DispatchLP(len(optimizer.prices), optimizer.params, optimizer.fixed_purchase_price)
+    lp.set_data(optimizer.prices, optimizer.pv_output, optimizer.load_profile)
+    timings['build'] += time.perf_counter() - start
+    start = time.perf_counter()
+    lp.solve()
+    timings['solve'] += time.perf_counter() - start
+
+
+def highs_day_ahead(optimizer, timings):
+    rolling_horizon = RollingHorizon(optimizer.params, optimizer.horizon_steps, optimizer.commit_steps, optimizer.fixed_purchase_price)
+    start = time.perf_counter()
+    for window_steps in {end - start_step for start_step, end, _ in rolling_horizon.windows(len(optimizer.prices))}:
+        rolling_horizon._solver(window_steps)  # Build the window models up front
+    timings['build'] += time.perf_counter() - start
+    start = time.perf_counter()
+    rolling_horizon.run(optimizer.prices, optimizer.pv_output, optimizer.load_profile)
+    timings['solve'] += time.perf_counter() - start
+
+
+def dynamic_programming(optimizer, timings):
+    start = time.perf_counter()
+    FastDispatch(optimizer.params, optimizer.fixed_purchase_price, optimizer.params.get('soc_levels', DEFAULT_SOC_LEVELS)).run(optimizer.prices, optimizer.pv_output, optimizer.load_profile)
+    timings['solve'] += time.perf_counter() - start
+
+
+def decomposition(optimizer, timings):
+    start = time.perf_counter()
+    block_steps = int(round(optimizer.params.get('block_hours', 168) / optimizer.params['delta_t']))
+    HorizonDecomposition(optimizer.params, block_steps, optimizer.fixed_purchase_price).run(optimizer.prices, optimizer.pv_output, optimizer.load_profile)
+    timings['solve'] += time.perf_counter() - start
+
+
+def decomposition_gap(optimizer):
+    # Relative gap of the decomposition objective to the monolithic LP, solved outside the timed runs
+    block_steps = int(round(optimizer.params.get('block_hours', 168) / optimizer.params['delta_t']))
+    decomposition = HorizonDecomposition(optimizer.params, block_steps, optimizer.fixed_purchase_price)
+    decomposition.run(optimizer.prices, optimizer.pv_output, optimizer.load_profile, reference=True)
+    return {'gap': decomposition.report['gap']}
+
+
+MODEL_RUNS = {
+    ('pulp', 'perfect_foresight'): pulp_perfect_foresight,
+    ('pulp', 'day_ahead'): pulp_day_ahead,
+    ('highs', 'perfect_foresight'): highs_perfect_foresight,
+    ('highs', 'day_ahead'): highs_day_ahead,
+    ('numpy', 'dynamic_programming'): dynamic_programming,
+    ('highs', 'decomposition'): decomposition,
+}
+
+# Accuracy columns of the rows of a model run
+MODEL_ACCURACY = {
+    ('highs', 'decomposition'): decomposition_gap,
+}
+
+
+def run_benchmarks(years=("2023", "2024"), horizons=(168, 720, 8760), backends=("pulp", "highs", "numpy"),
+                   repeat=1, pulp_max_hours=8760, X=20, fixed_purchase_price=False):
+    params = load_params(os.path.join(PROJECT_ROOT, 'data', 'params.csv'), True, True)
+    rows = []
+
+    def record(stage, year, horizon, seconds, peak_mib, **extra):
+        row = {'stage': stage, 'year': year, 'horizon_hours': horizon, 'seconds': seconds, 'peak_mib': peak_mib}
+        row.update(extra)
+        rows.append(row)
+        print(f"{stage:40s} {year} {horizon if horizon else '-':>8} h  {seconds:9.4f} s  {peak_mib:9.1f} MiB"
+              + ''.join(f"  {key} {value:.2e}" for key, value in extra.items()), flush=True)
+
+    for year in years:
+        year_dir = os.path.join(PROJECT_ROOT, 'data', year)
+        files = (os.path.join(year_dir, 'price_data.csv'), os.path.join(year_dir, 'pv_data.csv'), os.path.join(year_dir, 'load_profile.csv'))
+        leap_year_switch = calendar.isleap(int(year))
+        steps_per_hour = int(round(1 / params['delta_t']))
+
+        record('load_data', year, None, *measure(lambda: load_data(*files, leap_year_switch, params['delta_t']), repeat))
+        load_data_cached(*files, leap_year_switch, params['delta_t'])  # Fill the cache
+        record('load_data_cached (hit)', year, None, *measure(lambda: load_data_cached(*files, leap_year_switch, params['delta_t']), repeat))
+
+        prices, pv_output, load_profile, _ = load_data(*files, leap_year_switch, params['delta_t'])
+        record('normalize_data', year, None, *measure(lambda: normalize_data(prices, pv_output, load_profile, params, True), repeat))
+        prices, pv_output, load_profile = normalize_data(prices, pv_output, load_profile, params, True)
+
+        for horizon in horizons:
+            steps = horizon * steps_per_hour
+            horizon_prices, horizon_pv, horizon_load = (np.resize(series, steps) for series in (prices, pv_output, load_profile))
+
+            for (backend, optimization_type), model_run in MODEL_RUNS.items():
+                if backend not in backends or (backend == 'pulp' and horizon > pulp_max_hours):
+                    continue
+                optimizer = BatteryOptimization(horizon_prices, horizon_pv, horizon_load, params, optimization_type, fixed_purchase_price, 'pulp' if backend == 'pulp' else 'highs')
+                timings, peak_mib = measure_phases(model_run, optimizer, repeat)
+                accuracy = MODEL_ACCURACY[(backend, optimization_type)](optimizer) if (backend, optimization_type) in MODEL_ACCURACY else {}
+                for phase, seconds in timings.items():
+                    if seconds > 0:
+                        record(f'{optimization_type} {backend} {phase}', year, horizon, seconds, peak_mib, **accuracy)
+
+            results = BatteryOptimization(horizon_prices, horizon_pv, horizon_load, params, 'perfect_foresight', fixed_purchase_price, 'highs').optimize()
+            battery_investment_cost, pv_investment_cost, power_electronics_cost = calculate_investment_costs(params)
+
+            def calculate_profits():
+                battery = calculate_battery_profit(horizon_prices, results['charge_from_grid'], params['delta_t'], battery_investment_cost, X)
+                pv = calculate_pv_profit(results['sell_pv'], params['delta_t'], pv_investment_cost, X, params['feed_in_tariff'])
+                purchase = calculate_effective_profit_buy(params, horizon_prices, results['buy_from_grid'], params['delta_t'], X, fixed_purchase_price)
+                return np.asarray(calculate_total_profit(battery, pv, purchase, power_electronics_cost))
+
+            record('calculate_* (full series)', year, horizon, *measure(calculate_profits, repeat))
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark load, build, solve and post-processing stages")
+    parser.add_argument('--years', nargs='+', default=["2023", "2024"])
+    parser.add_argument('--horizons', nargs='+', type=int, default=[168, 720, 8760], help="Horizon lengths in hours")
+    parser.add_argument('--backends', nargs='+', default=["pulp", "highs", "numpy"])
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--pulp-max-hours', type=int, default=8760, help="Skip PuLP above this horizon")
+    parser.add_argument('--output', help="Write the results table to this CSV file")
+    args = parser.parse_args()
+
+    table = run_benchmarks(args.years, args.horizons, args.backends, args.repeat, args.pulp_max_hours)
+    if args.output:
+        table.to_csv(args.output, index=False)
@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import asyncio
+import inspect
+import argparse
+import calendar
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from scripts.utils.data_cache import load_data_cached
+from scripts.utils.params_loader import load_params
+from scripts.utils.normalizer import normalize_data
+from scripts.optimizations.battery_operation import BatteryOptimization
+from scripts.optimizations.results import FLOW_KEYS
+from scripts.optimizations.telemetry import Telemetry
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+# Forecast series of an Update, in the argument order of BatteryOptimization, 'soc' updates carry a measured SOC
+FORECAST_FIELDS = ('prices', 'pv_output', 'load_profile')
+
+# Filled once per worker process by _init_worker
+_shared = {}
+
+
+def _init_worker(params, settings):
+    _shared['params'] = params
+    _shared['settings'] = settings
+    _shared['model_store'] = None
+    if settings.get('model_dir') is not None:
+        from scripts.utils.model_store import ModelStore
+        _shared['model_store'] = ModelStore(settings['model_dir'])
+
+
+def _optimize(task):
+    # BatteryOptimization of the remaining horizon from the current SOC, runs in a worker process
+    prices, pv_output, load_profile, soc = task
+    settings = _shared['settings']
+    params = dict(_shared['params'], initial_soc=soc)
+    telemetry = Telemetry()
+    optimizer = BatteryOptimization(prices, pv_output, load_profile, params, settings['optimization_type'], settings['fixed_purchase_price'],
+                                    settings['backend'], telemetry=telemetry, model_store=_shared['model_store'])
+    return optimizer.optimize(), telemetry.records
+
+
+class Update:
+    # One message of a live source: field is one of FORECAST_FIELDS (values: the series from time step step on)
+    # or 'soc' (values: measured SOC at time step step). step also advances the service's clock, received is the
+    # time.perf_counter() value the update arrived at and is the reference of the published latencies.
+    __slots__ = ('step', 'field', 'values', 'received')
+
+    def __init__(self, step, field, values, received=None):
+        if field not in FORECAST_FIELDS + ('soc',):
+            raise ValueError("Invalid update field")
+        self.step = step
+        self.field = field
+        self.values = values
+        self.received = time.perf_counter() if received is None else received
+
+
+class ReplaySource:
+    # Stand-in for a market-data / metering feed built on the input files of data/<year>. Every step_seconds the
+    # clock advances one time step and a burst of forecast updates follows (prices, PV output and load profile of
+    # the next horizon_steps, in that order). Any object with an async updates() generator of Update works as a
+    # source of LiveDispatch.
+    def __init__(self, prices, pv_output, load_profile, horizon_steps=24, step_seconds=1.0, start=0, steps=None):
+        self.series = dict(zip(FORECAST_FIELDS, (np.asarray(series, dtype=float) for series in (prices, pv_output, load_profile))))
+        self.horizon_steps = horizon_steps
+        self.step_seconds = step_seconds
+        self.start = start
+        self.end = len(self.series['prices']) if steps is None else min(start + steps, len(self.series['prices']))
+
+    @classmethod
+    def from_year(cls, year, params, data_dir=DATA_DIR, pv_integration=True, price_scaling='min_max', **kwargs):
+        # Input files of data_dir/year, normalized like in scripts.main
+        year_dir = os.path.join(data_dir, str(year))
+        prices, pv_output, load_profile, _ = load_data_cached(
+            os.path.join(year_dir, 'price_data.csv'),
+            os.path.join(year_dir, 'pv_data.csv'),
+            os.path.join(year_dir, 'load_profile.csv'),
+            calendar.isleap(int(year)),
+            params['delta_t']
+        )
+        return cls(*normalize_data(prices, pv_output, load_profile, params, pv_integration, price_scaling), **kwargs)
+
+    async def updates(self):
+        for step in range(self.start, self.end):
+            for field in FORECAST_FIELDS:
+                yield Update(step, field, self.series[field][step:step + self.horizon_steps])
+            await asyncio.sleep(self.step_seconds)
+
+
+class LiveDispatch:
+    # Continuous dispatch service: ingests the updates of source, re-optimizes the remaining horizon (the current
+    # step up to the end of the shortest forecast) with BatteryOptimization in a worker process pool off the event
+    # loop and publishes the setpoints of the current step.
+    #   - Updates are debounced: a solve starts once no update arrived for debounce_seconds, but at the latest
+    #     max_delay_seconds after the first pending update. Updates arriving during a solve trigger the next one.
+    #   - When the clock advances, the setpoints of the new step are published from the current plan right away
+    #     (replanned False) and the SOC moves to the planned one unless a measured SOC arrives.
+    # Every setpoint (a dict of FLOW_KEYS values, soc_target and metrics) goes to the publishers, plain functions or
+    # coroutine functions, and is kept in latest / setpoints. latency_seconds is the time from the first update a
+    # setpoint accounts for to its publication.
+    def __init__(self, source, params, optimization_type="perfect_foresight", fixed_purchase_price=False, backend="highs",
+                 debounce_seconds=0.05, max_delay_seconds=1.0, max_workers=1, model_dir=None, publishers=None, telemetry=None):
+        self.source = source
+        self.params = params
+        self.settings = {
+            'optimization_type': optimization_type,
+            'fixed_purchase_price': fixed_purchase_price,
+            'backend': backend,
+            'model_dir': model_dir,
+        }
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.max_workers = max_workers
+        self.publishers = list(publishers or [])
+        self.telemetry = telemetry if telemetry is not None else Telemetry()  # Solves of all re-optimizations
+
+        self.step = None
+        self.soc = params['initial_soc']
+        self.forecasts = {}  # field -> (first step, values)
+        self.plan = None  # DispatchResults of the last re-optimization, starting at plan_start
+        self.plan_start = None
+        self.plan_status = None
+        self.latest = None
+        self.setpoints = []
+        self.solves = 0
+        self._pending = 0  # Updates since the last snapshot
+        self._first_received = None
+        self._dirty = None
+        self._closed = False
+
+    async def run(self):
+        # Runs until the source is exhausted and the last pending updates are optimized
+        self._dirty = asyncio.Event()
+        self._closed = False
+        with ProcessPoolExecutor(self.max_workers, initializer=_init_worker, initargs=(self.params, self.settings)) as executor:
+            optimizer = asyncio.create_task(self._optimize_loop(executor))
+            try:
+                async for update in self.source.updates():
+                    await self.apply(update)
+            finally:
+                self._closed = True
+                self._dirty.set()
+                if not optimizer.done():
+                    await optimizer
+        return self.setpoints
+
+    async def apply(self, update):
+        if self.step is None or update.step > self.step:
+            await self._advance(update.step)
+        if update.field == 'soc':
+            self.soc = float(update.values)
+        else:
+            self.forecasts[update.field] = (update.step, np.asarray(update.values, dtype=float))
+        if self._pending == 0:
+            self._first_received = update.received
+        self._pending += 1
+        self._dirty.set()
+
+    async def _advance(self, step):
+        self.step = step
+        if self.plan is not None and 0 <= step - self.plan_start < len(self.plan.soc):
+            planned_soc = self.plan.soc[step - self.plan_start]
+            if not np.isnan(planned_soc):
+                self.soc = float(planned_soc)
+            await self._publish(replanned=False)
+
+    def snapshot(self):
+        # (prices, pv_output, load_profile, SOC) of the remaining horizon, None until every forecast covers the current step
+        if any(field not in self.forecasts for field in FORECAST_FIELDS):
+            return None
+        end = min(start + len(values) for start, values in self.forecasts.values())
+        if end <= self.step or any(start > self.step for start, _ in self.forecasts.values()):
+            return None
+        series = [values[self.step - start:end - start] for start, values in (self.forecasts[field] for field in FORECAST_FIELDS)]
+        soc = min(max(self.soc, self.params['battery_capacity_min']), self.params['battery_capacity_max'])
+        return (*series, soc)
+
+    async def _debounce(self):
+        # Returns once no update arrived for debounce_seconds or max_delay_seconds passed since the first pending one
+        while not self._closed:
+            self._clear()
+            timeout = min(self.debounce_seconds, self._first_received + self.max_delay_seconds - time.perf_counter())
+            if timeout <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._dirty.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+
+    def _clear(self):
+        # Once the source is closed the event stays set, so no wait can miss the close
+        if not self._closed:
+            self._dirty.clear()
+
+    async def _optimize_loop(self, executor):
+        loop = asyncio.get_running_loop()
+        while not (self._closed and self._pending == 0):
+            await self._dirty.wait()
+            if self._pending == 0:
+                self._clear()
+                continue
+            await self._debounce()
+            self._clear()
+            task = self.snapshot()
+            if task is None:
+                if self._closed:
+                    break  # The forecasts can no longer be completed
+                continue  # Keep the updates pending until the forecasts are complete
+            first_received, coalesced = self._first_received, self._pending
+            self._pending = 0
+            plan_start = self.step
+
+            solve_start = time.perf_counter()
+            results, records = await loop.run_in_executor(executor, _optimize, task)
+            solve_seconds = time.perf_counter() - solve_start
+            for record in records:
+                self.telemetry.record(**dict(record, window=self.solves, start=plan_start + record['start'], end=plan_start + record['end']))
+            self.solves += 1
+            self.plan, self.plan_start = results, plan_start
+            self.plan_status = 'Optimal' if all(record['status'] == 'Optimal' for record in records) else 'Failed'
+            await self._publish(
+                replanned=True, latency_seconds=time.perf_counter() - first_received, solve_seconds=solve_seconds,
+                coalesced_updates=coalesced
+            )
+
+    async def _publish(self, replanned, latency_seconds=0.0, solve_seconds=0.0, coalesced_updates=0):
+        i = self.step - self.plan_start
+        if i >= len(self.plan.soc) - 1:
+            return  # The plan ends before the current step
+        setpoint = {'step': self.step, 'plan_start': self.plan_start, 'replanned': replanned, 'status': self.plan_status}
+        setpoint.update({key: float(self.plan[key][i]) for key in FLOW_KEYS})
+        setpoint.update(
+            soc=self.soc, soc_target=float(self.plan.soc[i + 1]), latency_seconds=latency_seconds,
+            solve_seconds=solve_seconds, coalesced_updates=coalesced_updates
+        )
+        self.latest = setpoint
+        self.setpoints.append(setpoint)
+        for publisher in self.publishers:
+            result = publisher(setpoint)
+            if inspect.isawaitable(result):
+                await result
+
+    def latency_summary(self):
+        # Latency of the re-optimized setpoints, e.g. to size debounce_seconds and the worker pool
+        latencies = np.array([setpoint['latency_seconds'] for setpoint in self.setpoints if setpoint['replanned']])
+        if len(latencies) == 0:
+            return {'published': len(self.setpoints), 'solves': self.solves}
+        return {
+            'published': len(self.setpoints),
+            'solves': self.solves,
+            'coalesced_updates': sum(setpoint['coalesced_updates'] for setpoint in self.setpoints),
+            'latency_mean_seconds': float(np.mean(latencies)),
+            'latency_p95_seconds': float(np.percentile(latencies, 95)),
+            'latency_max_seconds': float(np.max(latencies)),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays data/<year> as a live feed and prints the setpoints as JSON lines")
+    parser.add_argument('--year', default="2023")
+    parser.add_argument('--steps', type=int, default=48, help="Number of time steps to replay")
+    parser.add_argument('--horizon-steps', type=int, default=24, help="Length of the replayed forecasts")
+    parser.add_argument('--step-seconds', type=float, default=0.2, help="Wall-clock seconds per replayed time step")
+    parser.add_argument('--backend', choices=["pulp", "highs"], default="highs")
+    parser.add_argument('--model-dir', help="ModelStore directory of the workers")
+    args = parser.parse_args()
+
+    params = load_params(os.path.join(DATA_DIR, 'params.csv'), battery_integration=True, pv_integration=True)
+    source = ReplaySource.from_year(args.year, params, horizon_steps=args.horizon_steps, step_seconds=args.step_seconds, steps=args.steps)
+    service = LiveDispatch(source, params, backend=args.backend, model_dir=args.model_dir, publishers=[lambda setpoint: print(json.dumps(setpoint))])
+    asyncio.run(service.run())
+    print(json.dumps(service.latency_summary()))
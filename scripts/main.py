@@ -1,76 +1,188 @@
-import sys
 import os
-import pandas as pd
+import sys
+import json
+import calendar
+import argparse
 
 # https://echtsolar.de/preise-solarmodule
 
-# Pfad zum Projektverzeichnis hinzufügen
-PROJECT_ROOT = "/workspaces/opt_dispatch_"  # <- Passe diesen Pfad an, falls nötig
-sys.path.insert(0, PROJECT_ROOT)
-sys.path.insert(0, os.path.join(PROJECT_ROOT, "scripts"))  # Falls 'scripts' ein Modul ist
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not __package__:
+    sys.path.insert(0, PROJECT_ROOT)  # Started as a file (python scripts/main.py) instead of python -m scripts.main
 
-# Jetzt die Importe durchführen
-from scripts.utils.data_loader import load_data
+from scripts.utils.data_cache import load_data_cached
 from scripts.optimizations.battery_operation import BatteryOptimization
-from scripts.utils.plotter import Plotter
-from scripts.utils.calculate_profit import (
-    calculate_battery_profit, calculate_pv_profit, calculate_investment_costs,
-    calculate_effective_profit_buy, calculate_total_profit
-)
+from scripts.pipeline import run_dispatch, calculate_profits
 from scripts.utils.params_loader import load_params
 from scripts.utils.normalizer import normalize_data
-from scripts.utils.csv_saver import save_results_to_csv
-
-# Define parameters for the script
-X = 20  # Number of years to extend
-soc_range = (1320,1400)  # Plot window for SOC and electricity prices (e.g., first week)
-profit_range = (0, 8760 * X)  # Plot window for cumulative profit (e.g., entire period)
-year = "2023" # Year of the data
-leap_year_switch = False  # Set to True if year is a leap year
-battery_integration = False  # Set to True to include battery storage in the optimization
-pv_integration = True  # Set to True to include PV system in the optimization
-fixed_purchase_price = True  # Set to True to use a fixed electricity price for grid purchases
-optimization_type = "perfect_foresight"  # Select optimization type, "perfect_foresight" or "day_ahead"
-
-# Load parameters
-print("Load Parameters")
-params_file_path = os.path.join(PROJECT_ROOT, 'data', 'params.csv')
-params = load_params(params_file_path, battery_integration, pv_integration)
-
-# Load data
-print("Load Data")
-price_file_path = os.path.join(PROJECT_ROOT, 'data', year, 'price_data.csv')
-pv_file_path = os.path.join(PROJECT_ROOT, 'data', year, 'pv_data.csv')
-load_profile_path = os.path.join(PROJECT_ROOT, 'data', year, 'load_profile.csv')
-prices, pv_output, load_profile, timestamps = load_data(price_file_path, pv_file_path, load_profile_path, leap_year_switch)
-
-# Normalize data
-print("Normalize Data")
-prices, pv_output, load_profile = normalize_data(prices, pv_output, load_profile, params, pv_integration)
-
-# Run optimization
-print("Start Optimization")
-optimizer = BatteryOptimization(prices, pv_output, load_profile, params, optimization_type, fixed_purchase_price)
-results = optimizer.optimize()
-
-# Calculate investment costs
-battery_investment_cost, pv_investment_cost, power_electronics_cost = calculate_investment_costs(params)
-
-# Calculate profit
-print("Calculate Profit")
-extended_profit_battery = calculate_battery_profit(prices, results['charge_from_grid'], params['delta_t'], battery_investment_cost, X)
-extended_profit_pv = calculate_pv_profit(results['sell_pv'], params['delta_t'], pv_investment_cost, X, params['feed_in_tariff'])
-extended_effective_profit_from_purchase = calculate_effective_profit_buy(params, prices, results['buy_from_grid'], params['delta_t'], X, fixed_purchase_price)
-total_profit = calculate_total_profit(extended_profit_battery, extended_profit_pv, extended_effective_profit_from_purchase, power_electronics_cost)
-
-# Save results to CSV
-print("Save Results")
-save_results_to_csv(year, prices, results, load_profile, params, total_profit)
-
-# Extend the dates for X years
-extended_dates = pd.date_range(start=timestamps[0], periods=len(timestamps) * X, freq='h')
-
-# Plot results
-print("Plot Results")
-plotter = Plotter()
-plotter.plot_results(extended_dates, prices, results['soc'], results['charge_from_grid'], results['charge_from_pv'], results['use_pv'], results['use_battery'], results['sell_pv'], results['buy_from_grid'], extended_profit_battery, extended_profit_pv, extended_effective_profit_from_purchase, total_profit, soc_range, profit_range, optimization_type.title(), power_electronics_cost, params)
\ No newline at end of file
+from scripts.utils.tariff import Tariff, local_start
+
+# Default settings, overridden by a JSON config file (same keys) and then by command line arguments
+DEFAULTS = {
+    'X': 20,  # Number of years to extend
+    'soc_range': [1320, 1400],  # Plot window for SOC and electricity prices in hours (e.g., first week)
+    'profit_range': None,  # Plot window for cumulative profit in hours, None for the entire period
+    'year': "2023",  # Year of the data, leap years are detected from it
+    'battery_integration': False,  # Include battery storage in the optimization
+    'pv_integration': True,  # Include PV system in the optimization
+    'fixed_purchase_price': True,  # Use a fixed electricity price for grid purchases
+    'tariff': None,  # Tariff settings (keyword arguments of Tariff, e.g. {"grid_fee": 0.1, "peak_charge": 10}), requires fixed_purchase_price False
+    'degradation': False,  # Dispatch every year of the X-year projection with the capacity faded by calendar_fade / cycle_fade (params.csv), with the chosen optimization_type and backend
+    'price_scaling': None,  # "min_max" (prices scaled to [0, 1]), "eur_per_kwh" or "none", defaults to eur_per_kwh with a tariff and min_max otherwise
+    'optimization_type': "perfect_foresight",  # "perfect_foresight", "day_ahead", "dynamic_programming" or "decomposition"
+    'backend': "pulp",  # "pulp" (PuLP/CBC) or "highs" (sparse matrix model solved with HiGHS)
+    'horizon_hours': 24,  # Day-ahead only: lookahead of each rolling window (e.g. 36)
+    'commit_hours': 24,  # Day-ahead only: hours of each window that are committed before the window moves on
+    'decomposition_reference': False,  # Decomposition only: also solve the monolithic LP and report the relative gap to it
+    'data_dir': os.path.join(PROJECT_ROOT, 'data'),  # Contains params.csv and one directory of input files per year
+    'params_file': None,  # Defaults to data_dir/params.csv
+    'results_dir': None,  # Output directory of the results time series, defaults to results/year (not tracked by git)
+    'stream_results': False,  # Day-ahead only: append every committed window to results_committed in results_dir while the optimization runs
+    'results_format': "csv",  # "csv", "parquet" or "feather" (the latter two require pyarrow)
+    'telemetry_file': None,  # Optional JSON lines file, one record per solve (model size, build / solve time, status, objective)
+    'result_cache_dir': None,  # Directory of the dispatch result cache, repeated runs of the same dispatch problem skip the solve
+    'model_dir': None,  # Directory of stored HiGHS backend models (e.g. data/.cache/models), loaded instead of rebuilt
+    'solver_tmp_dir': None,  # Directory of CBC's temporary files (PuLP backend, e.g. a tmpfs mount), defaults to the system temp directory
+    'plot_dir': None,  # Save the plots as PNG files here instead of showing them (works without a display)
+    'headless': False,  # Skip interactive plotting, matplotlib is only imported if plot_dir is set
+}
+
+
+def parse_args(argv=None):
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument('--config', help="JSON file with settings, keys as in DEFAULTS")
+    config_args, _ = config_parser.parse_known_args(argv)
+
+    settings = dict(DEFAULTS)
+    if config_args.config:
+        with open(config_args.config) as file:
+            config = json.load(file)
+        unknown = set(config) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown settings in {config_args.config}: {', '.join(sorted(unknown))}")
+        settings.update(config)
+
+    parser = argparse.ArgumentParser(description="Optimal dispatch of a home battery and PV system", parents=[config_parser])
+    parser.add_argument('--year')
+    parser.add_argument('--X', type=int, help="Number of years to extend the profit calculation to")
+    parser.add_argument('--battery-integration', action=argparse.BooleanOptionalAction)
+    parser.add_argument('--pv-integration', action=argparse.BooleanOptionalAction)
+    parser.add_argument('--fixed-purchase-price', action=argparse.BooleanOptionalAction)
+    parser.add_argument('--tariff', type=json.loads, help="Tariff settings as JSON, e.g. '{\"grid_fee\": 0.1, \"peak_charge\": 10}'")
+    parser.add_argument('--price-scaling', choices=["min_max", "eur_per_kwh", "none"])
+    parser.add_argument('--degradation', action=argparse.BooleanOptionalAction, help="Re-dispatch every year with the faded battery capacity")
+    parser.add_argument('--optimization-type', choices=["perfect_foresight", "day_ahead", "dynamic_programming", "decomposition"])
+    parser.add_argument('--backend', choices=["pulp", "highs"])
+    parser.add_argument('--horizon-hours', type=float)
+    parser.add_argument('--commit-hours', type=float)
+    parser.add_argument('--decomposition-reference', action=argparse.BooleanOptionalAction, help="Report the gap of the decomposition to the monolithic LP")
+    parser.add_argument('--soc-range', type=int, nargs=2, metavar=('START', 'END'), help="SOC plot window in hours")
+    parser.add_argument('--profit-range', type=int, nargs=2, metavar=('START', 'END'), help="Profit plot window in hours")
+    parser.add_argument('--data-dir')
+    parser.add_argument('--params-file')
+    parser.add_argument('--results-dir')
+    parser.add_argument('--stream-results', action=argparse.BooleanOptionalAction, help="Write committed day-ahead windows while the optimization runs")
+    parser.add_argument('--results-format', choices=["csv", "parquet", "feather"])
+    parser.add_argument('--telemetry-file')
+    parser.add_argument('--result-cache-dir', help="Cache dispatch results here (e.g. data/.cache/results)")
+    parser.add_argument('--model-dir', help="Store and load HiGHS backend models here (e.g. data/.cache/models)")
+    parser.add_argument('--solver-tmp-dir', help="Directory of CBC's temporary files")
+    parser.add_argument('--plot-dir', help="Save the plots as files in this directory instead of showing them")
+    parser.add_argument('--headless', action=argparse.BooleanOptionalAction, help="Skip interactive plotting")
+    parser.set_defaults(**settings)
+    return parser.parse_args(argv)
+
+
+def run(args):
+    X = args.X
+
+    # Load parameters
+    print("Load Parameters")
+    params_file_path = args.params_file or os.path.join(args.data_dir, 'params.csv')
+    params = load_params(params_file_path, args.battery_integration, args.pv_integration)
+
+    # Convert the plot windows from hours to time steps (delta_t in params.csv sets the resolution, e.g. 0.25 for 15 minutes)
+    steps_per_hour = 1 / params['delta_t']
+    soc_range = tuple(int(round(hour * steps_per_hour)) for hour in args.soc_range)
+
+    # Load data
+    print("Load Data")
+    year_dir = os.path.join(args.data_dir, str(args.year))
+    price_file_path = os.path.join(year_dir, 'price_data.csv')
+    pv_file_path = os.path.join(year_dir, 'pv_data.csv')
+    load_profile_path = os.path.join(year_dir, 'load_profile.csv')
+    leap_year_switch = calendar.isleap(int(args.year))
+    prices, pv_output, load_profile, timestamps = load_data_cached(price_file_path, pv_file_path, load_profile_path, leap_year_switch, params['delta_t'])
+
+    profit_end = len(prices) * X if args.profit_range is None else min(int(round(args.profit_range[1] * steps_per_hour)), len(prices) * X)
+    profit_range = (0 if args.profit_range is None else int(round(args.profit_range[0] * steps_per_hour)), profit_end)
+
+    # Normalize data
+    print("Normalize Data")
+    price_scaling = args.price_scaling or ("eur_per_kwh" if args.tariff is not None else "min_max")
+    prices, pv_output, load_profile = normalize_data(prices, pv_output, load_profile, params, args.pv_integration, None if price_scaling == "none" else price_scaling)
+    start = local_start(timestamps)  # Local wall-clock time of the first step
+    tariff = Tariff(**args.tariff).series(prices, start, params) if args.tariff is not None else None
+
+    # Run optimization
+    print("Start Optimization")
+    results_dir = args.results_dir or os.path.join(PROJECT_ROOT, 'results', str(args.year))
+    stream_writer = None
+    if args.stream_results:
+        if args.optimization_type != "day_ahead" or args.degradation:
+            raise ValueError("Streaming results requires the day_ahead optimization type without degradation")
+        from scripts.utils.results_writer import ResultsWriter
+        stream_writer = ResultsWriter(results_dir, args.results_format, 'results_committed')
+    model_store = None
+    if args.model_dir is not None:
+        from scripts.utils.model_store import ModelStore
+        model_store = ModelStore(args.model_dir)
+    optimizer = BatteryOptimization(prices, pv_output, load_profile, params, args.optimization_type, args.fixed_purchase_price, args.backend, args.horizon_hours, args.commit_hours, tariff=tariff,
+                                    model_store=model_store, solver_tmp_dir=args.solver_tmp_dir, decomposition_reference=args.decomposition_reference, timestamps=timestamps,
+                                    on_commit=None if stream_writer is None else stream_writer.on_commit(timestamps, prices if tariff is None else tariff.buy, load_profile))
+    prices = optimizer.prices  # Buy prices of the tariff
+    result_cache = None
+    if args.result_cache_dir is not None and not args.degradation and stream_writer is None:  # A cache hit commits no windows
+        from scripts.utils.result_cache import ResultCache
+        result_cache = ResultCache(args.result_cache_dir)
+    try:
+        results, dispatch, capacities = run_dispatch(optimizer, X, args.degradation, result_cache)
+    finally:
+        if stream_writer is not None:
+            stream_writer.close()
+    if capacities is not None:
+        print(f"Battery capacity {capacities[0]:.2f} kWh in the first, {capacities[-1]:.2f} kWh in the last year")
+    telemetry = optimizer.telemetry.summary()
+    print(f"{telemetry['solves']} solve(s), {telemetry['failed_solves']} failed, build {telemetry['build_seconds']:.2f} s, solve {telemetry['solve_seconds']:.2f} s")
+    for record in optimizer.telemetry.records:
+        if record.get('reference'):
+            print(f"Decomposition gap to the monolithic LP {record['gap']:.2e}")
+    if args.telemetry_file is not None:
+        optimizer.telemetry.write_jsonl(args.telemetry_file)
+
+    # Calculate profit
+    print("Calculate Profit")
+    profits = calculate_profits(params, prices, dispatch, X, args.fixed_purchase_price, tariff)
+    total_profit = profits['total']
+
+    # Save results
+    print("Save Results")
+    from scripts.utils.results_writer import ResultsWriter
+    ResultsWriter(results_dir, args.results_format).write(results, timestamps, prices, load_profile, total_profit)
+
+    if args.plot_dir is None and args.headless:
+        return results, total_profit
+
+    # Plot results, saved as files without a GUI backend if plot_dir is set
+    print("Plot Results")
+    from scripts.utils.plotter import Plotter
+    plotter = Plotter(args.plot_dir)
+    plotter.plot_results(start, prices, load_profile, results, profits['battery'], profits['pv'], profits['purchase'], total_profit, soc_range, profit_range, args.optimization_type.title(), params)
+    return results, total_profit
+
+def main(argv=None):
+    run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+from scripts.optimizations.matrix_model import DispatchLP, PersistentSolver, FLOW_KEYS, solve_lp
+from scripts.optimizations.telemetry import Telemetry, result_fields
+
+
+class BatchOptimization:
+    # Perfect foresight dispatch of N households against one price curve.
+    #   pv_outputs, load_profiles: arrays of shape (N, T)
+    #   household_params: optional {param name: array of N values} overriding params per household
+    #   grid_connection_max: optional shared feeder limit (kW) on the summed grid import and on the summed
+    #                        PV feed-in of all households in every time step
+    # Without a shared limit the households are independent and solved one after another, reusing the solver
+    # (and its basis) while the household parameters stay the same. With a shared limit all households are
+    # solved as one block-diagonal LP with the coupling rows appended. Every solve is recorded in telemetry (one
+    # record per household, or a single one for the coupled LP), households without a solution are NaN.
+    def __init__(self, prices, pv_outputs, load_profiles, params, household_params=None, fixed_purchase_price=False, grid_connection_max=None, telemetry=None):
+        self.prices = np.asarray(prices, dtype=float)
+        self.pv_outputs = np.atleast_2d(np.asarray(pv_outputs, dtype=float))
+        self.load_profiles = np.atleast_2d(np.asarray(load_profiles, dtype=float))
+        if self.pv_outputs.shape != self.load_profiles.shape:
+            raise ValueError("pv_outputs and load_profiles must have the same shape (households, time steps)")
+        self.households = self.load_profiles.shape[0]
+        self.time_steps = len(self.prices)
+        self.params = params
+        self.household_params = {key: np.broadcast_to(values, (self.households,)) for key, values in (household_params or {}).items()}
+        self.fixed_purchase_price = fixed_purchase_price
+        self.grid_connection_max = grid_connection_max
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+
+    def params_of(self, household):
+        params = dict(self.params)
+        params.update({key: float(values[household]) for key, values in self.household_params.items()})
+        return params
+
+    def _household_lps(self):
+        lps = []
+        for n in range(self.households):
+            lp = DispatchLP(self.time_steps, self.params_of(n), self.fixed_purchase_price)
+            lp.set_data(self.prices, self.pv_outputs[n], self.load_profiles[n])
+            lps.append(lp)
+        return lps
+
+    def optimize(self):
+        if self.grid_connection_max is None:
+            return self.fan_out_optimize()
+        return self.coupled_optimize()
+
+    def _empty_results(self):
+        results = {key: np.full((self.households, self.time_steps), np.nan) for key in FLOW_KEYS}
+        results['soc'] = np.full((self.households, self.time_steps + 1), np.nan)
+        return results
+
+    def _store(self, results, n, lp, x):
+        if x is None:
+            return
+        for key in FLOW_KEYS + ['soc']:
+            results[key][n] = x[lp.col_slice(key)]
+
+    def fan_out_optimize(self):
+        results = self._empty_results()
+        solver = None
+        previous_params = None
+        for n in range(self.households):
+            build_start = time.perf_counter()
+            params = self.params_of(n)
+            if params != previous_params:
+                solver = PersistentSolver(DispatchLP(self.time_steps, params, self.fixed_purchase_price))
+                previous_params = params
+            solver.lp.set_data(self.prices, self.pv_outputs[n], self.load_profiles[n])
+            solve_start = time.perf_counter()
+            res = solver.solve()
+            self.telemetry.record(
+                window=n, start=0, end=self.time_steps, num_variables=solver.lp.num_cols, num_constraints=solver.lp.num_rows,
+                build_seconds=solve_start - build_start, solve_seconds=time.perf_counter() - solve_start, household=n, **result_fields(res)
+            )
+            self._store(results, n, solver.lp, res.x)
+        return results
+
+    def coupled_optimize(self):
+        build_start = time.perf_counter()
+        lps = self._household_lps()
+        T = self.time_steps
+
+        # Coupling rows: sum over households of (charge_from_grid + buy_from_grid) and of sell_pv per time step
+        def selector(lp, keys):
+            columns = np.concatenate([np.arange(lp.num_cols)[lp.col_slice(key)] for key in keys])
+            return sp.csr_matrix((np.ones(len(columns)), (np.tile(np.arange(T), len(keys)), columns)), shape=(T, lp.num_cols))
+
+        import_blocks = [selector(lp, ['charge_from_grid', 'buy_from_grid']) for lp in lps]
+        export_blocks = [selector(lp, ['sell_pv']) for lp in lps]
+        coupling = sp.vstack([sp.hstack(import_blocks), sp.hstack(export_blocks)], format='csr')
+
+        A_eq = sp.block_diag([lp.A_eq for lp in lps], format='csr')
+        A_ub = sp.vstack([sp.block_diag([lp.A_ub for lp in lps]), coupling], format='csr')
+        row_lower = np.concatenate([lp.row_lower for lp in lps] + [np.full(2 * T, -np.inf)])
+        row_upper = np.concatenate([lp.row_upper for lp in lps] + [np.full(2 * T, self.grid_connection_max)])
+        eq_rows = np.concatenate([lp.eq_rows for lp in lps] + [np.zeros(2 * T, dtype=bool)])
+        solve_start = time.perf_counter()
+        res = solve_lp(
+            np.concatenate([lp.cost for lp in lps]), A_eq, A_ub, row_lower, row_upper, eq_rows,
+            np.concatenate([lp.col_lower for lp in lps]), np.concatenate([lp.col_upper for lp in lps])
+        )
+        self.telemetry.record(
+            window=0, start=0, end=T, num_variables=A_eq.shape[1], num_constraints=len(eq_rows),
+            build_seconds=solve_start - build_start, solve_seconds=time.perf_counter() - solve_start, household=None, **result_fields(res)
+        )
+
+        results = self._empty_results()
+        if res.x is not None:
+            offset = 0
+            for n, lp in enumerate(lps):
+                self._store(results, n, lp, res.x[offset:offset + lp.num_cols])
+                offset += lp.num_cols
+        return results
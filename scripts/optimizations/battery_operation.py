@@ -1,128 +1,253 @@
+import time
+import tempfile
 import numpy as np
-from pulp import LpProblem, LpMinimize, LpVariable, lpSum, value
+from scripts.optimizations.telemetry import Telemetry
+from scripts.optimizations.results import FLOW_KEYS, DispatchResults
+
+# The solver backends (PuLP, SciPy / HiGHS) are imported in the methods that use them, so importing this module
+# stays cheap for batch workers that only need one of them
 
 class BatteryOptimization:
-    def __init__(self, prices, pv_output, load_profile, params, optimization_type="perfect_foresight", fixed_purchase_price=False):
+    def __init__(self, prices, pv_output, load_profile, params, optimization_type="perfect_foresight", fixed_purchase_price=False, backend="pulp", horizon_hours=24, commit_hours=24, telemetry=None, tariff=None, model_store=None, solver_tmp_dir=None, on_commit=None, decomposition_reference=False, timestamps=None):
+        # tariff: optional TariffSeries, its buy prices replace prices and its sell prices feed_in_tariff. A
+        # peak-demand charge or time-varying sell prices are only supported by perfect_foresight, the other
+        # optimization types take a tariff with a constant sell price.
+        if tariff is not None:
+            if fixed_purchase_price:
+                raise ValueError("A tariff replaces the fixed purchase price")
+            if optimization_type.lower() != "perfect_foresight" and (tariff.has_peak_charge or not tariff.constant_sell):
+                raise ValueError("Peak-demand charges and time-varying sell prices require perfect_foresight")
+            prices = tariff.buy
+            params = dict(params, feed_in_tariff=float(tariff.sell[0]))
         self.prices = prices
         self.pv_output = pv_output
         self.load_profile = load_profile
         self.params = params
+        self.tariff = tariff
         self.optimization_type = optimization_type.lower()
         self.fixed_purchase_price = fixed_purchase_price
+        self.backend = backend.lower()  # "pulp" (per-timestep PuLP model, CBC) or "highs" (sparse matrix model, HiGHS)
+        if self.backend not in ("pulp", "highs"):
+            raise ValueError("Invalid backend")
+        # Day-ahead rolling horizon: look ahead horizon_hours, keep the first commit_hours of each window
+        self.horizon_steps = int(round(horizon_hours / self.params['delta_t']))
+        self.commit_steps = int(round(commit_hours / self.params['delta_t']))
+        if self.optimization_type == "day_ahead" and (self.commit_steps < 1 or self.horizon_steps < self.commit_steps):
+            raise ValueError("Horizon must be at least as long as the commit length")
+        # Model size, build / solve time, status, objective and iterations of every solve, see Telemetry
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        # Optional ModelStore: HiGHS backend models are loaded from it instead of being rebuilt
+        self.model_store = model_store
+        # Directory of CBC's temporary files (PuLP backend), None for the system default
+        self.solver_tmp_dir = solver_tmp_dir
+        # Optional on_commit(start, chunk), called with the committed part of every day-ahead window, e.g.
+        # ResultsWriter.on_commit(...) to write long runs while they are optimized
+        self.on_commit = on_commit
+        # Decomposition only: also solve the monolithic LP and record the relative gap to it, see HorizonDecomposition
+        self.decomposition_reference = decomposition_reference
+        self.decomposition_report = None  # HorizonDecomposition.report of the last decomposition run
+        self.timestamps = timestamps  # Optional time stamps of the steps (e.g. from load_data), attached to the results
+        self._pulp_models = {}  # PuLP model structures, see _pulp_structure
 
     def optimize(self):
         if self.optimization_type == "perfect_foresight":
-            return self.perfect_foresight_optimize()
+            results = self.perfect_foresight_optimize()
         elif self.optimization_type == "day_ahead":
-            return self.day_ahead_optimize()
+            results = self.day_ahead_optimize()
+        elif self.optimization_type == "dynamic_programming":
+            results = self.dynamic_programming_optimize()
+        elif self.optimization_type == "decomposition":
+            results = self.decomposition_optimize()
         else:
             raise ValueError("Invalid optimization type")
+        results.timestamps = self.timestamps
+        return results
 
-    def perfect_foresight_optimize(self):
-        time_steps = len(self.prices)
-        model = LpProblem("PerfectForesightOptimization", LpMinimize)
-        charge_from_grid_vars = [LpVariable(f"ChargeFromGrid_{t}", 0, self.params['charge_power_max']) for t in range(time_steps)]
-        buy_from_grid_vars = [LpVariable(f"BuyFromGrid_{t}", 0, self.params['grid_power_max']) for t in range(time_steps)]
-        charge_from_pv_vars = [LpVariable(f"ChargeFromPV_{t}", 0, self.params['charge_power_max']) for t in range(time_steps)]
-        use_pv_vars = [LpVariable(f"UsePV_{t}", 0, self.params['pv_capacity']) for t in range(time_steps)]
-        use_battery_vars = [LpVariable(f"UseBattery_{t}", 0, self.params['discharge_power_max']) for t in range(time_steps)]
-        sell_pv_vars = [LpVariable(f"SellPV_{t}", 0, self.params['pv_capacity']) for t in range(time_steps)]
-        soc_vars = [LpVariable(f"SOC_{t}", self.params['battery_capacity_min'], self.params['battery_capacity_max']) for t in range(time_steps + 1)]
-
-        # Objective function: Minimize cost (prices) and maximize use of PV output and battery discharge
-        if self.fixed_purchase_price:
-            model += lpSum([self.params['reference_fixed_price'] * (charge_from_grid_vars[t] + buy_from_grid_vars[t]) for t in range(time_steps)]) - lpSum([self.params['feed_in_tariff'] * sell_pv_vars[t] for t in range(time_steps)])
-        else:
-            model += lpSum([self.prices[t] * (charge_from_grid_vars[t] + buy_from_grid_vars[t]) for t in range(time_steps)]) - lpSum([self.params['feed_in_tariff'] * sell_pv_vars[t] for t in range(time_steps)])
+    def incremental(self):
+        # Persistent perfect foresight model of this data for repeated re-solves, see IncrementalOptimization
+        from scripts.optimizations.incremental import IncrementalOptimization
+        if self.tariff is not None and (self.tariff.has_peak_charge or not self.tariff.constant_sell):
+            raise ValueError("Peak-demand charges and time-varying sell prices are not supported by incremental re-solves")
+        return IncrementalOptimization(self.prices, self.pv_output, self.load_profile, self.params, self.fixed_purchase_price, telemetry=self.telemetry)
+
+    def degradation(self, years):
+        # Dispatch of every year of a years-long projection with capacity fade, see DegradationDispatch. Perfect
+        # foresight with HiGHS re-solves one persistent model, other optimization types and backends run this
+        # optimization once per year with the faded capacity.
+        from scripts.optimizations.degradation import DegradationDispatch
+        solve = None
+        if (self.optimization_type, self.backend) != ("perfect_foresight", "highs"):
+            def solve(params):
+                return BatteryOptimization(
+                    self.prices, self.pv_output, self.load_profile, params, self.optimization_type, self.fixed_purchase_price, self.backend,
+                    self.horizon_steps * params['delta_t'], self.commit_steps * params['delta_t'], self.telemetry, self.tariff,
+                    self.model_store, self.solver_tmp_dir, decomposition_reference=self.decomposition_reference, timestamps=self.timestamps
+                ).optimize()
+        return DegradationDispatch(self.prices, self.pv_output, self.load_profile, self.params, years, self.fixed_purchase_price, self.tariff, self.telemetry, self.model_store, solve, self.timestamps)
+
+    def _pulp_structure(self, start, end, name):
+        # PuLP model of a window of end - start time steps with all data dependent coefficients left at zero,
+        # built once per window length (and billing periods, only perfect foresight has a peak-demand charge)
+        from pulp import LpProblem, LpMinimize, LpVariable, LpAffineExpression
+        periods = None
+        if self.tariff is not None and self.tariff.has_peak_charge:
+            periods = self.tariff.periods[start:end] - self.tariff.periods[start]
+        key = (end - start, name, None if periods is None else periods.tobytes())
+        if key in self._pulp_models:
+            return self._pulp_models[key]
 
-        # Constraints
-        model += soc_vars[0] == self.params['initial_soc']
-        for t in range(time_steps):
+        steps = end - start
+        model = LpProblem(name, LpMinimize)
+        charge_from_grid_vars = [LpVariable(f"ChargeFromGrid_{t}", 0, self.params['charge_power_max']) for t in range(steps)]
+        buy_from_grid_vars = [LpVariable(f"BuyFromGrid_{t}", 0, self.params['grid_power_max']) for t in range(steps)]
+        charge_from_pv_vars = [LpVariable(f"ChargeFromPV_{t}", 0, self.params['charge_power_max']) for t in range(steps)]
+        use_pv_vars = [LpVariable(f"UsePV_{t}", 0, self.params['pv_capacity']) for t in range(steps)]
+        use_battery_vars = [LpVariable(f"UseBattery_{t}", 0, self.params['discharge_power_max']) for t in range(steps)]
+        sell_pv_vars = [LpVariable(f"SellPV_{t}", 0, self.params['pv_capacity']) for t in range(steps)]
+        soc_vars = [LpVariable(f"SOC_{t}", self.params['battery_capacity_min'], self.params['battery_capacity_max']) for t in range(steps + 1)]
+        peak_vars = [] if periods is None else [LpVariable(f"Peak_{p}", 0) for p in range(int(periods[-1]) + 1)]
+
+        # Objective function: Minimize cost (prices) and maximize use of PV output and battery discharge, the
+        # coefficients are written by build_pulp_model. Energy terms are price times power (EUR per delta_t
+        # hours), so the peak-demand charge is divided by delta_t.
+        flow_vars = charge_from_grid_vars + buy_from_grid_vars + charge_from_pv_vars + use_battery_vars + sell_pv_vars
+        peak_cost = self.tariff.peak_charge / self.params['delta_t'] if peak_vars else 0.0
+        model += LpAffineExpression([(var, 0.0) for var in flow_vars] + [(var, peak_cost) for var in peak_vars])
+
+        # Constraints, the right-hand sides of the data dependent ones are written by build_pulp_model
+        constraints = {'initial_soc': soc_vars[0] == 0, 'pv_split': [], 'load_balance': []}
+        model += constraints['initial_soc']
+        for t in range(steps):
             model += soc_vars[t + 1] == soc_vars[t] + (np.sqrt(self.params['efficiency']) * (charge_from_grid_vars[t] + charge_from_pv_vars[t]) - (1 / np.sqrt(self.params['efficiency'])) * use_battery_vars[t]) * self.params['delta_t']
             model += soc_vars[t + 1] >= self.params['battery_capacity_min']
             model += soc_vars[t + 1] <= self.params['battery_capacity_max']
-            model += charge_from_pv_vars[t] + use_pv_vars[t] + sell_pv_vars[t] <= self.pv_output[t]  # Limit charging from PV, using PV, and selling PV to available PV output
+            constraints['pv_split'].append(charge_from_pv_vars[t] + use_pv_vars[t] + sell_pv_vars[t] <= 0)  # Limit charging from PV, using PV, and selling PV to available PV output
+            model += constraints['pv_split'][-1]
             model += charge_from_grid_vars[t] + charge_from_pv_vars[t] <= self.params['charge_power_max']  # Total charging power limit
             model += use_battery_vars[t] <= self.params['discharge_power_max']  # Limit discharge to battery power
-            model += self.load_profile[t] == (use_pv_vars[t] + use_battery_vars[t] + buy_from_grid_vars[t])  # Ensure load profile is met
-
-        # Solve the optimization problem
-        model.solve()
-
-        charge_from_grid = [value(var) for var in charge_from_grid_vars]
-        buy_from_grid = [value(var) for var in buy_from_grid_vars]
-        charge_from_pv = [value(var) for var in charge_from_pv_vars]
-        use_pv = [value(var) for var in use_pv_vars]
-        use_battery = [value(var) for var in use_battery_vars]
-        sell_pv = [value(var) for var in sell_pv_vars]
-        soc = [value(var) for var in soc_vars]
-
-        return {
-            'charge_from_grid': charge_from_grid,
-            'buy_from_grid': buy_from_grid,
-            'charge_from_pv': charge_from_pv,
-            'use_pv': use_pv,
-            'use_battery': use_battery,
-            'sell_pv': sell_pv,
-            'soc': soc
+            constraints['load_balance'].append(use_pv_vars[t] + use_battery_vars[t] + buy_from_grid_vars[t] == 0)  # Ensure load profile is met
+            model += constraints['load_balance'][-1]
+            if peak_vars:
+                model += charge_from_grid_vars[t] + buy_from_grid_vars[t] <= peak_vars[periods[t]]  # Grid import below the billing period's peak
+
+        variables = {
+            'charge_from_grid': charge_from_grid_vars,
+            'buy_from_grid': buy_from_grid_vars,
+            'charge_from_pv': charge_from_pv_vars,
+            'use_pv': use_pv_vars,
+            'use_battery': use_battery_vars,
+            'sell_pv': sell_pv_vars,
+            'soc': soc_vars,
+            'peak': peak_vars
         }
+        self._pulp_models[key] = model, variables, constraints
+        return self._pulp_models[key]
+
+    def build_pulp_model(self, start, end, initial_soc, name="PerfectForesightOptimization"):
+        # PuLP model of the time steps start..end-1, returns the model and its variables per result key (plus
+        # one peak variable per billing period with a peak-demand charge). The structure of a window length is
+        # built once and only the prices, PV output, load profile and initial SOC are written into it.
+        model, variables, constraints = self._pulp_structure(start, end, name)
+        if self.fixed_purchase_price:
+            purchase_prices = np.full(end - start, self.params['reference_fixed_price'])
+        else:
+            purchase_prices = np.asarray(self.prices[start:end], dtype=float)
+        sell_prices = self.tariff.sell[start:end] if self.tariff is not None else np.full(end - start, self.params['feed_in_tariff'])
+        cycle_cost = self.params.get('cycle_cost', 0.0)  # Optional wear cost per kWh of battery throughput (charged plus discharged)
+
+        objective = model.objective
+        for t in range(end - start):
+            objective[variables['charge_from_grid'][t]] = purchase_prices[t] + cycle_cost
+            objective[variables['buy_from_grid'][t]] = purchase_prices[t]
+            objective[variables['charge_from_pv'][t]] = cycle_cost
+            objective[variables['use_battery'][t]] = cycle_cost
+            objective[variables['sell_pv'][t]] = -sell_prices[t]
+            constraints['pv_split'][t].constant = -self.pv_output[start + t]
+            constraints['load_balance'][t].constant = -self.load_profile[start + t]
+        constraints['initial_soc'].constant = -initial_soc
+        return model, variables
+
+    def solve_pulp_model(self, start, end, initial_soc, name="PerfectForesightOptimization", window=0):
+        # Builds and solves one PuLP model, records it in the telemetry and returns the solver status and the
+        # solution as DispatchResults (NaN if the solve did not end optimal). CBC's model and solution files are
+        # written to a temporary directory in solver_tmp_dir (e.g. a tmpfs mount) that is removed after the solve.
+        from pulp import LpStatus, PULP_CBC_CMD, value
+        build_start = time.perf_counter()
+        model, variables = self.build_pulp_model(start, end, initial_soc, name)
+        solve_start = time.perf_counter()
+        with tempfile.TemporaryDirectory(prefix='pulp-', dir=self.solver_tmp_dir) as tmp_dir:
+            solver = PULP_CBC_CMD(msg=False)
+            solver.tmpDir = tmp_dir
+            model.solve(solver)
+        status = LpStatus[model.status]
+        self.telemetry.record(
+            window=window, start=start, end=end, num_variables=model.numVariables(), num_constraints=model.numConstraints(),
+            build_seconds=solve_start - build_start, solve_seconds=time.perf_counter() - solve_start, status=status,
+            objective=value(model.objective) if status == 'Optimal' else None, iterations=None  # CBC does not report iterations through PuLP
+        )
+        results = DispatchResults.empty(end - start)
+        if status == 'Optimal':
+            for key in FLOW_KEYS + ['soc']:
+                results[key] = [var.varValue for var in variables[key]]
+        return status, results
+
+    def perfect_foresight_optimize(self):
+        if self.backend == "highs":
+            from scripts.optimizations.matrix_model import solve_dispatch_lp
+            return solve_dispatch_lp(self.prices, self.pv_output, self.load_profile, self.params, self.fixed_purchase_price, telemetry=self.telemetry, tariff=self.tariff, model_store=self.model_store)
+
+        _, results = self.solve_pulp_model(0, len(self.prices), self.params['initial_soc'])
+        return results
+
+    def dynamic_programming_optimize(self):
+        # Perfect foresight on a discretised SOC grid without an LP solver, see FastDispatch for the tolerance
+        from scripts.optimizations.fast_dispatch import FastDispatch, DEFAULT_SOC_LEVELS
+        start = time.perf_counter()
+        fast_dispatch = FastDispatch(self.params, self.fixed_purchase_price, self.params.get('soc_levels', DEFAULT_SOC_LEVELS))
+        results = fast_dispatch.run(self.prices, self.pv_output, self.load_profile)
+        objective = None
+        if fast_dispatch.status == 'Optimal':
+            purchase_price = self.params['reference_fixed_price'] if self.fixed_purchase_price else np.asarray(self.prices, dtype=float)
+            objective = np.sum(purchase_price * (results['charge_from_grid'] + results['buy_from_grid'])) - self.params['feed_in_tariff'] * np.sum(results['sell_pv'])
+            objective = float(objective + self.params.get('cycle_cost', 0.0) * np.sum(results['charge_from_grid'] + results['charge_from_pv'] + results['use_battery']))
+        else:
+            results = DispatchResults.empty(len(self.prices))  # The schedule violates grid_power_max or pv_capacity
+        self.telemetry.record(
+            window=0, start=0, end=len(self.prices), num_variables=None, num_constraints=None, build_seconds=0.0,
+            solve_seconds=time.perf_counter() - start, status=fast_dispatch.status, objective=objective, iterations=None
+        )
+        return results
+
+    def decomposition_optimize(self):
+        # Perfect foresight in blocks of block_hours coupled by the boundary SOC, see HorizonDecomposition
+        from scripts.optimizations.decomposition import HorizonDecomposition
+        block_steps = int(round(self.params.get('block_hours', 168) / self.params['delta_t']))
+        decomposition = HorizonDecomposition(self.params, block_steps, self.fixed_purchase_price, telemetry=self.telemetry, model_store=self.model_store)
+        results = decomposition.run(self.prices, self.pv_output, self.load_profile, reference=self.decomposition_reference)
+        self.decomposition_report = decomposition.report
+        return results
 
     def day_ahead_optimize(self):
+        if self.backend == "highs":
+            from scripts.optimizations.rolling_horizon import RollingHorizon
+            rolling_horizon = RollingHorizon(self.params, self.horizon_steps, self.commit_steps, self.fixed_purchase_price, self.telemetry, self.model_store)
+            return rolling_horizon.run(self.prices, self.pv_output, self.load_profile, on_commit=self.on_commit)
+
         time_steps = len(self.prices)
-        day_ahead_steps = 24  # Assuming each day has 24 time steps and we look ahead one day
-        charge_from_grid = []
-        buy_from_grid = []
-        charge_from_pv = []
-        use_pv = []
-        use_battery = []
-        sell_pv = []
-        soc = [self.params['initial_soc']]
-
-        for start in range(0, time_steps, day_ahead_steps):
-            end = min(start + day_ahead_steps, time_steps)
-            model = LpProblem("DayAheadOptimization", LpMinimize)
-            charge_from_grid_vars = [LpVariable(f"ChargeFromGrid_{t}", 0, self.params['charge_power_max']) for t in range(start, end)]
-            buy_from_grid_vars = [LpVariable(f"BuyFromGrid_{t}", 0, self.params['grid_power_max']) for t in range(start, end)]
-            charge_from_pv_vars = [LpVariable(f"ChargeFromPV_{t}", 0, self.params['charge_power_max']) for t in range(start, end)]
-            use_pv_vars = [LpVariable(f"UsePV_{t}", 0, self.params['pv_capacity']) for t in range(start, end)]
-            use_battery_vars = [LpVariable(f"UseBattery_{t}", 0, self.params['discharge_power_max']) for t in range(start, end)]
-            sell_pv_vars = [LpVariable(f"SellPV_{t}", 0, self.params['pv_capacity']) for t in range(start, end)]
-            soc_vars = [LpVariable(f"SOC_{t}", self.params['battery_capacity_min'], self.params['battery_capacity_max']) for t in range(start, end + 1)]
-
-            # Objective function: Minimize cost (prices) and maximize use of PV output and battery discharge
-            if self.fixed_purchase_price:
-                model += lpSum([self.params['reference_fixed_price'] * (charge_from_grid_vars[t - start] + buy_from_grid_vars[t - start]) for t in range(start, end)]) - lpSum([self.params['feed_in_tariff'] * sell_pv_vars[t - start] for t in range(start, end)])
-            else:
-                model += lpSum([self.prices[t] * (charge_from_grid_vars[t - start] + buy_from_grid_vars[t - start]) for t in range(start, end)]) - lpSum([self.params['feed_in_tariff'] * sell_pv_vars[t - start] for t in range(start, end)])
-
-            # Constraints
-            model += soc_vars[0] == soc[-1]
-            for t in range(start, end):
-                model += soc_vars[t - start + 1] == soc_vars[t - start] + (np.sqrt(self.params['efficiency']) * (charge_from_grid_vars[t - start] + charge_from_pv_vars[t - start]) - (1 / np.sqrt(self.params['efficiency'])) * use_battery_vars[t - start]) * self.params['delta_t']
-                model += soc_vars[t - start + 1] >= self.params['battery_capacity_min']
-                model += soc_vars[t - start + 1] <= self.params['battery_capacity_max']
-                model += charge_from_pv_vars[t - start] + use_pv_vars[t - start] + sell_pv_vars[t - start] <= self.pv_output[t]  # Limit charging from PV, using PV, and selling PV to available PV output
-                model += charge_from_grid_vars[t - start] + charge_from_pv_vars[t - start] <= self.params['charge_power_max']  # Total charging power limit
-                model += use_battery_vars[t - start] <= self.params['discharge_power_max']  # Limit discharge to battery power
-                model += self.load_profile[t] == (use_pv_vars[t - start] + use_battery_vars[t - start] + buy_from_grid_vars[t - start])  # Ensure load profile is met
-
-            # Solve the optimization problem
-            model.solve()
-
-            charge_from_grid.extend([value(var) for var in charge_from_grid_vars])
-            buy_from_grid.extend([value(var) for var in buy_from_grid_vars])
-            charge_from_pv.extend([value(var) for var in charge_from_pv_vars])
-            use_pv.extend([value(var) for var in use_pv_vars])
-            use_battery.extend([value(var) for var in use_battery_vars])
-            sell_pv.extend([value(var) for var in sell_pv_vars])
-            soc.extend([value(var) for var in soc_vars[1:]])
-
-        return {
-            'charge_from_grid': charge_from_grid,
-            'buy_from_grid': buy_from_grid,
-            'charge_from_pv': charge_from_pv,
-            'use_pv': use_pv,
-            'use_battery': use_battery,
-            'sell_pv': sell_pv,
-            'soc': soc
-        }
\ No newline at end of file
+        results = DispatchResults.empty(time_steps, self.params['initial_soc'])
+        soc = self.params['initial_soc']
+
+        for window, start in enumerate(range(0, time_steps, self.commit_steps)):
+            end = min(start + self.horizon_steps, time_steps)
+            committed = min(self.commit_steps, time_steps - start)
+            status, window_results = self.solve_pulp_model(start, end, soc, "DayAheadOptimization", window)
+
+            # Keep only the committed part of the window, a failed window is committed as NaN and the next
+            # window starts from the last known SOC
+            results.put(start, window_results, committed)
+            if status == 'Optimal':
+                soc = results.soc[start + committed]
+            if self.on_commit is not None:
+                self.on_commit(start, results.window(start, start + committed))
+
+        return results
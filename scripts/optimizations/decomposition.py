@@ -0,0 +1,138 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from scripts.optimizations.matrix_model import PersistentSolver, dispatch_lp, solve_dispatch_lp
+from scripts.optimizations.results import DispatchResults
+from scripts.optimizations.fast_dispatch import FastDispatch, DEFAULT_SOC_LEVELS
+from scripts.optimizations.telemetry import Telemetry, result_fields
+
+# Filled once per worker process by _init_worker
+_shared = {}
+
+
+def _init_worker(prices, pv_output, load_profile, params, fixed_purchase_price, model_store=None):
+    _shared.update(prices=prices, pv_output=pv_output, load_profile=load_profile, params=params, fixed_purchase_price=fixed_purchase_price, model_store=model_store)
+    _shared['solvers'] = {}  # window length -> PersistentSolver
+
+
+def _solve_window(task):
+    # Perfect foresight LP of the time steps start..end-1 with fixed initial SOC and, unless None, fixed final SOC
+    start, end, initial_soc, final_soc = task
+    build_start = time.perf_counter()
+    if end - start not in _shared['solvers']:
+        _shared['solvers'][end - start] = PersistentSolver(dispatch_lp(end - start, _shared['params'], _shared['fixed_purchase_price'], model_store=_shared['model_store']))
+    solver = _shared['solvers'][end - start]
+    lp = solver.lp
+    lp.set_data(_shared['prices'][start:end], _shared['pv_output'][start:end], _shared['load_profile'][start:end], initial_soc)
+    last_soc = lp.col_slice('soc').stop - 1
+    if final_soc is None:
+        lp.col_lower[last_soc], lp.col_upper[last_soc] = _shared['params']['battery_capacity_min'], _shared['params']['battery_capacity_max']
+    else:
+        lp.col_lower[last_soc] = lp.col_upper[last_soc] = final_soc
+    solve_start = time.perf_counter()
+    res = solver.solve()
+    record = dict(
+        start=start, end=end, num_variables=lp.num_cols, num_constraints=lp.num_rows,
+        build_seconds=solve_start - build_start, solve_seconds=time.perf_counter() - solve_start, **result_fields(res)
+    )
+    return lp.unpack(res.x), record
+
+
+class HorizonDecomposition:
+    # Perfect foresight dispatch of a long horizon (years, 15 minute resolution) as blocks of block_steps time
+    # steps that are only coupled through the SOC at the block boundaries.
+    #   1. Boundary SOCs from the FastDispatch trajectory, which is close to the LP optimum and feasible for it
+    #   2. All blocks are solved in parallel with fixed initial and final SOC
+    #   3. Coordination sweeps: every pair of neighbouring blocks is re-solved with its middle boundary SOC free,
+    #      first the pairs starting at even, then at odd blocks (pairs of one phase share no boundary and run in
+    #      parallel). The current schedule is feasible for every pair, so the total cost never increases. The
+    #      sweeps stop early once a sweep improves the objective by less than tolerance (relative).
+    # report holds the objective after every phase and, with reference=True, the monolithic LP objective and the
+    # relative gap to it. The monolithic solve is then also recorded in the telemetry (reference=True, gap).
+    def __init__(self, params, block_steps=168, fixed_purchase_price=False, sweeps=3, tolerance=1e-9, max_workers=None, telemetry=None, model_store=None):
+        if block_steps < 1:
+            raise ValueError("block_steps must be positive")
+        self.params = params
+        self.block_steps = int(block_steps)
+        self.fixed_purchase_price = fixed_purchase_price
+        self.sweeps = sweeps
+        self.tolerance = tolerance
+        self.max_workers = max_workers
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.model_store = model_store  # Optional ModelStore, every worker loads the block models from it
+        self.report = {}
+
+    def _map(self, executor, tasks):
+        results = executor.map(_solve_window, tasks) if executor is not None else map(_solve_window, tasks)
+        solutions = []
+        for (window, record), task in zip(results, tasks):
+            self.telemetry.record(window=task[0] // self.block_steps, **record)
+            solutions.append(window)
+        return solutions
+
+    def _objective(self, results, prices):
+        purchase_price = self.params['reference_fixed_price'] if self.fixed_purchase_price else prices
+        throughput = results['charge_from_grid'] + results['charge_from_pv'] + results['use_battery']
+        return float(np.sum(purchase_price * (results['charge_from_grid'] + results['buy_from_grid'])) - self.params['feed_in_tariff'] * np.sum(results['sell_pv']) + self.params.get('cycle_cost', 0.0) * np.sum(throughput))
+
+    def run(self, prices, pv_output, load_profile, initial_soc=None, reference=False):
+        if initial_soc is None:
+            initial_soc = self.params['initial_soc']
+        prices, pv_output, load_profile = (np.asarray(series, dtype=float) for series in (prices, pv_output, load_profile))
+        time_steps = len(prices)
+        bounds = list(range(0, time_steps, self.block_steps)) + [time_steps]
+        blocks = len(bounds) - 1
+
+        start = time.perf_counter()
+        fast_dispatch = FastDispatch(self.params, self.fixed_purchase_price, self.params.get('soc_levels', DEFAULT_SOC_LEVELS))
+        boundary_soc = fast_dispatch.run(prices, pv_output, load_profile, initial_soc).soc[bounds].tolist()
+        boundary_soc[0] = initial_soc
+        boundary_soc[-1] = None  # The final SOC of the horizon stays free
+        self.report = {'blocks': blocks, 'boundary_seconds': time.perf_counter() - start, 'objective': []}
+
+        results = DispatchResults.empty(time_steps, initial_soc)
+
+        max_workers = 1 if blocks == 1 else self.max_workers
+        init_args = (prices, pv_output, load_profile, self.params, self.fixed_purchase_price, self.model_store)
+        executor = None
+        if max_workers != 1:
+            executor = ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=init_args)
+        else:
+            _init_worker(*init_args)
+        try:
+            start = time.perf_counter()
+            tasks = [(bounds[b], bounds[b + 1], boundary_soc[b], boundary_soc[b + 1]) for b in range(blocks)]
+            for task, window in zip(tasks, self._map(executor, tasks)):
+                results.put(task[0], window)
+            self.report['objective'].append(self._objective(results, prices))
+
+            for _ in range(self.sweeps if blocks > 1 else 0):
+                for first in (0, 1):
+                    tasks = [(bounds[b], bounds[b + 2], boundary_soc[b], boundary_soc[b + 2]) for b in range(first, blocks - 1, 2)]
+                    for (b, task), window in zip(zip(range(first, blocks - 1, 2), tasks), self._map(executor, tasks)):
+                        if not np.isnan(window.soc[0]):
+                            results.put(task[0], window)
+                            boundary_soc[b + 1] = results.soc[bounds[b + 1]]
+                    self.report['objective'].append(self._objective(results, prices))
+                if self.report['objective'][-3] - self.report['objective'][-1] <= self.tolerance * abs(self.report['objective'][-1]):
+                    break
+            self.report['seconds'] = time.perf_counter() - start
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if reference:
+            start = time.perf_counter()
+            reference_telemetry = Telemetry()
+            monolithic = solve_dispatch_lp(prices, pv_output, load_profile, self.params, self.fixed_purchase_price, initial_soc, reference_telemetry, model_store=self.model_store)
+            monolithic_objective = self._objective(monolithic, prices)
+            self.report.update({
+                'monolithic_objective': monolithic_objective,
+                'monolithic_seconds': time.perf_counter() - start,
+                'gap': (self.report['objective'][-1] - monolithic_objective) / abs(monolithic_objective) if monolithic_objective else np.nan,
+            })
+            self.telemetry.record(**dict(reference_telemetry.records[0], window=None, reference=True, gap=self.report['gap']))
+
+        return results
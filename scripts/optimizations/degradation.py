@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+
+from scripts.optimizations.matrix_model import PersistentSolver, dispatch_lp
+from scripts.optimizations.telemetry import Telemetry, result_fields
+
+
+def equivalent_full_cycles(results, capacity, delta_t):
+    # Throughput (charged plus discharged energy) of one dispatch in full cycles of the given capacity
+    throughput = np.sum(results['charge_from_grid'] + results['charge_from_pv'] + results['use_battery']) * delta_t
+    return throughput / (2 * capacity) if capacity > 0 else 0.0
+
+
+def faded_capacity(params, capacity, cycles):
+    # Capacity after one more year: calendar_fade and cycle_fade (per equivalent full cycle) are fractions of the
+    # initial capacity params['battery_capacity_max'], the capacity never drops below battery_capacity_min
+    fade = params.get('calendar_fade', 0.0) + params.get('cycle_fade', 0.0) * cycles
+    return max(params['battery_capacity_min'], capacity - fade * params['battery_capacity_max'])
+
+
+class DegradationDispatch:
+    # Perfect foresight dispatch of every year of an X-year projection with the battery capacity left after the
+    # previous years (see faded_capacity), so the later years of the profit projection are not computed with the
+    # new battery. The wear cost params['cycle_cost'] enters every year's objective (see DispatchLP.fill).
+    # The model of the input year is built once: between years only the SOC upper bounds (and the initial SOC
+    # if it exceeds the capacity) change, so the persistent HiGHS model warm-starts from the previous basis, and a
+    # year whose capacity did not change reuses the previous dispatch without a solve. solve (params -> results)
+    # replaces the persistent model for other optimization types and backends, see BatteryOptimization.degradation,
+    # it gets params with the year's battery_capacity_max and initial_soc. timestamps are attached to every year's results.
+    def __init__(self, prices, pv_output, load_profile, params, years, fixed_purchase_price=False, tariff=None, telemetry=None, model_store=None, solve=None, timestamps=None):
+        self.prices = prices
+        self.pv_output = pv_output
+        self.load_profile = load_profile
+        self.params = params
+        self.years = years
+        self.fixed_purchase_price = fixed_purchase_price
+        self.tariff = tariff  # Optional TariffSeries, see solve_dispatch_lp
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.model_store = model_store  # Optional ModelStore the model is loaded from
+        self.solve = solve
+        self.timestamps = timestamps
+        self.capacities = np.full(years, float(params['battery_capacity_max']))
+        self.cycles = np.zeros(years)
+
+    def run(self):
+        # Returns one DispatchResults per year, self.capacities / self.cycles hold the capacity and equivalent
+        # full cycles of every year
+        solver = None
+        build_seconds = 0.0
+        if self.solve is None:
+            build_start = time.perf_counter()
+            periods = self.tariff.periods if self.tariff is not None and self.tariff.has_peak_charge else None
+            solver = PersistentSolver(dispatch_lp(len(self.prices), self.params, self.fixed_purchase_price, periods, self.model_store))
+            build_seconds = time.perf_counter() - build_start
+
+        yearly = []
+        capacity = float(self.params['battery_capacity_max'])
+        for year in range(self.years):
+            self.capacities[year] = capacity
+            if yearly and capacity == self.capacities[year - 1]:
+                yearly.append(yearly[-1])  # Same capacity, same dispatch
+                self.cycles[year] = self.cycles[year - 1]
+            elif solver is None:
+                yearly.append(self.solve(dict(self.params, battery_capacity_max=capacity, initial_soc=min(self.params['initial_soc'], capacity))))
+                self.cycles[year] = equivalent_full_cycles(yearly[-1], capacity, self.params['delta_t'])
+            else:
+                lp = solver.lp
+                build_start = time.perf_counter()
+                lp.col_upper[lp.col_slice('soc')] = capacity
+                lp.set_data(self.prices, self.pv_output, self.load_profile, min(self.params['initial_soc'], capacity),
+                            None if self.tariff is None else self.tariff.sell, 0.0 if self.tariff is None else self.tariff.peak_charge)
+                solve_start = time.perf_counter()
+                res = solver.solve()
+                self.telemetry.record(
+                    window=year, start=0, end=len(self.prices), num_variables=lp.num_cols, num_constraints=lp.num_rows,
+                    build_seconds=build_seconds + solve_start - build_start, solve_seconds=time.perf_counter() - solve_start,
+                    capacity=capacity, **result_fields(res)
+                )
+                build_seconds = 0.0
+                yearly.append(lp.unpack(res.x))
+                yearly[-1].timestamps = self.timestamps
+                self.cycles[year] = equivalent_full_cycles(yearly[-1], capacity, self.params['delta_t'])
+            capacity = faded_capacity(self.params, capacity, self.cycles[year])
+        return yearly
@@ -0,0 +1,59 @@
+import time
+
+import numpy as np
+
+from scripts.optimizations.matrix_model import DispatchLP, PersistentSolver
+from scripts.optimizations.telemetry import Telemetry, result_fields
+
+
+class IncrementalOptimization:
+    # Perfect foresight dispatch over a fixed horizon that stays in memory between solves, for live re-dispatch
+    # when price curves, PV or load forecasts or the measured SOC change while the battery parameters stay the
+    # same. The update_* methods overwrite the stored series (from time step start onwards, so a forecast update
+    # of the remaining hours is enough) and optimize() only pushes the changed cost coefficients and row bounds
+    # to the persistent HiGHS model, which warm-starts from the previous basis.
+    def __init__(self, prices, pv_output, load_profile, params, fixed_purchase_price=False, initial_soc=None, telemetry=None):
+        build_start = time.perf_counter()
+        self.params = params
+        self.prices = np.array(prices, dtype=float)
+        self.pv_output = np.array(pv_output, dtype=float)
+        self.load_profile = np.array(load_profile, dtype=float)
+        self.soc = params['initial_soc'] if initial_soc is None else initial_soc
+        self.solver = PersistentSolver(DispatchLP(len(self.prices), params, fixed_purchase_price))
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self._build_seconds = time.perf_counter() - build_start  # Reported with the first solve
+        self.solves = 0
+
+    @staticmethod
+    def _update(series, values, start):
+        values = np.asarray(values, dtype=float)
+        if start < 0 or start + len(values) > len(series):
+            raise ValueError("Update does not fit into the horizon")
+        series[start:start + len(values)] = values
+
+    def update_prices(self, prices, start=0):
+        self._update(self.prices, prices, start)
+
+    def update_pv(self, pv_output, start=0):
+        self._update(self.pv_output, pv_output, start)
+
+    def update_load(self, load_profile, start=0):
+        self._update(self.load_profile, load_profile, start)
+
+    def update_soc(self, soc):
+        self.soc = soc
+
+    def optimize(self):
+        build_start = time.perf_counter()
+        lp = self.solver.lp
+        lp.set_data(self.prices, self.pv_output, self.load_profile, self.soc)
+        solve_start = time.perf_counter()
+        res = self.solver.solve()
+        self.telemetry.record(
+            window=self.solves, start=0, end=lp.time_steps, num_variables=lp.num_cols, num_constraints=lp.num_rows,
+            build_seconds=self._build_seconds + solve_start - build_start, solve_seconds=time.perf_counter() - solve_start,
+            **result_fields(res)
+        )
+        self._build_seconds = 0.0
+        self.solves += 1
+        return lp.unpack(res.x)
@@ -0,0 +1,295 @@
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import linprog, OptimizeResult
+
+from scripts.optimizations.telemetry import result_fields
+# Order of the per-timestep decision variables in the column vector, followed by the SOC chain (time_steps + 1)
+from scripts.optimizations.results import FLOW_KEYS, DispatchResults
+# Per-timestep row blocks of the constraint matrix, after the single initial SOC row ('peak' only with billing periods)
+ROW_BLOCKS = ['soc_balance', 'pv_split', 'charge_limit', 'load_balance', 'peak']
+
+
+def solve_lp(cost, A_eq, A_ub, row_lower, row_upper, eq_rows, col_lower, col_upper):
+    # Inequality rows only have an upper bound, equality rows have row_lower == row_upper
+    return linprog(
+        cost,
+        A_ub=A_ub, b_ub=row_upper[~eq_rows],
+        A_eq=A_eq, b_eq=row_lower[eq_rows],
+        bounds=np.column_stack([col_lower, col_upper]),
+        method='highs'
+    )
+
+
+class DispatchLP:
+    # Matrix form of the battery dispatch problem used in BatteryOptimization:
+    #   min  cost @ x   s.t.  row_lower <= A @ x <= row_upper,  col_lower <= x <= col_upper
+    # The constraint matrix only depends on the horizon length and the battery parameters, the time series
+    # (prices, PV output, load profile) and the initial SOC only enter the cost vector and the row bounds.
+    # With periods (billing period of every step, see TariffSeries) one peak column per billing period follows
+    # the SOC chain, bounded from below by the grid import of each of its steps, so a peak-demand charge only
+    # adds num_periods columns.
+    def __init__(self, time_steps, params, fixed_purchase_price=False, periods=None):
+        self._set_shape(time_steps, params, fixed_purchase_price, periods)
+        self.A = self._build_matrix()
+        self.col_lower, self.col_upper = self._build_bounds()
+        self._init_rows()
+
+    def _set_shape(self, time_steps, params, fixed_purchase_price, periods):
+        self.time_steps = time_steps
+        self.params = params
+        self.fixed_purchase_price = fixed_purchase_price
+        self.periods = None if periods is None else np.asarray(periods)[:time_steps] - periods[0]
+        self.num_periods = 0 if periods is None else int(self.periods[-1]) + 1
+        self.num_cols = len(FLOW_KEYS) * time_steps + time_steps + 1 + self.num_periods
+        self.num_rows = 1 + (4 if periods is None else 5) * time_steps
+
+    def _init_rows(self):
+        # Row blocks: initial SOC, SOC balance, PV split, charge limit, load balance
+        self.eq_rows = np.zeros(self.num_rows, dtype=bool)
+        for block in ('initial_soc', 'soc_balance', 'load_balance'):
+            self.eq_rows[self.row_slice(block)] = True
+        self.A_eq = self.A[self.eq_rows]
+        self.A_ub = self.A[~self.eq_rows]
+
+        self.cost = np.zeros(self.num_cols)
+        self.row_lower = np.full(self.num_rows, -np.inf)
+        self.row_upper = np.zeros(self.num_rows)
+        self.row_lower[self.eq_rows] = 0.0
+        self.row_upper[self.row_slice('charge_limit')] = self.params['charge_power_max']
+
+    def col_slice(self, key):
+        T = self.time_steps
+        if key == 'soc':
+            return slice(len(FLOW_KEYS) * T, (len(FLOW_KEYS) + 1) * T + 1)
+        if key == 'peak':
+            return slice((len(FLOW_KEYS) + 1) * T + 1, self.num_cols)
+        i = FLOW_KEYS.index(key)
+        return slice(i * T, (i + 1) * T)
+
+    def row_slice(self, block):
+        T = self.time_steps
+        if block == 'initial_soc':
+            return slice(0, 1)
+        i = ROW_BLOCKS.index(block)
+        return slice(1 + i * T, 1 + (i + 1) * T)
+
+    def _build_matrix(self):
+        T = self.time_steps
+        eff = self.params['efficiency']
+        delta_t = self.params['delta_t']
+        charge_coeff = np.sqrt(eff) * delta_t
+        discharge_coeff = (1 / np.sqrt(eff)) * delta_t
+
+        I = sp.identity(T, format='csr')
+        soc_init = sp.csr_matrix(([1.0], ([0], [0])), shape=(1, T + 1))
+        soc_diff = sp.eye(T, T + 1, k=1, format='csr') - sp.eye(T, T + 1, k=0, format='csr')
+
+        # Columns: charge_from_grid, buy_from_grid, charge_from_pv, use_pv, use_battery, sell_pv, soc
+        blocks = [
+            [None, None, None, None, None, None, soc_init],  # soc[0] == initial_soc
+            [-charge_coeff * I, None, -charge_coeff * I, None, discharge_coeff * I, None, soc_diff],  # SOC balance
+            [None, None, I, I, None, I, None],  # charge_from_pv + use_pv + sell_pv <= pv_output
+            [I, None, I, None, None, None, None],  # charge_from_grid + charge_from_pv <= charge_power_max
+            [None, I, None, I, I, None, None],  # use_pv + use_battery + buy_from_grid == load_profile
+        ]
+        if self.periods is not None:
+            # charge_from_grid + buy_from_grid <= peak of the step's billing period
+            in_period = sp.csr_matrix((np.ones(T), (np.arange(T), self.periods)), shape=(T, self.num_periods))
+            blocks = [row + [None] for row in blocks] + [[I, I, None, None, None, None, None, -in_period]]
+        return sp.bmat(blocks, format='csr')
+
+    def _build_bounds(self):
+        T = self.time_steps
+        upper = {
+            'charge_from_grid': self.params['charge_power_max'],
+            'buy_from_grid': self.params['grid_power_max'],
+            'charge_from_pv': self.params['charge_power_max'],
+            'use_pv': self.params['pv_capacity'],
+            'use_battery': self.params['discharge_power_max'],
+            'sell_pv': self.params['pv_capacity'],
+        }
+        col_lower = np.zeros(self.num_cols)
+        col_upper = np.zeros(self.num_cols)
+        for key in FLOW_KEYS:
+            col_upper[self.col_slice(key)] = upper[key]
+        col_lower[self.col_slice('soc')] = self.params['battery_capacity_min']
+        col_upper[self.col_slice('soc')] = self.params['battery_capacity_max']
+        col_upper[self.col_slice('peak')] = np.inf
+        return col_lower, col_upper
+
+    def set_data(self, prices, pv_output, load_profile, initial_soc=None, sell_prices=None, peak_charge=0.0):
+        self.fill(self.cost, self.row_lower, self.row_upper, prices, pv_output, load_profile, initial_soc, sell_prices, peak_charge)
+
+    def fill(self, cost, row_lower, row_upper, prices, pv_output, load_profile, initial_soc=None, sell_prices=None, peak_charge=0.0):
+        # Writes the data dependent entries into cost (..., num_cols) and row bounds (..., num_rows). The series
+        # may have leading dimensions, e.g. (scenarios, time_steps) to fill the arrays of all scenarios at once.
+        # sell_prices (per step) replaces params['feed_in_tariff'], peak_charge is the cost per peak column. The
+        # energy terms are price times power, i.e. EUR per delta_t hours, so the peak charge is divided by delta_t.
+        # params['cycle_cost'] (EUR per kWh charged or discharged, optional) prices the battery throughput.
+        T = self.time_steps
+        cycle_cost = self.params.get('cycle_cost', 0.0)
+        if initial_soc is None:
+            initial_soc = self.params['initial_soc']
+
+        if self.fixed_purchase_price:
+            purchase_price = self.params['reference_fixed_price']
+        else:
+            purchase_price = np.asarray(prices, dtype=float)[..., :T]
+        cost[..., self.col_slice('charge_from_grid')] = purchase_price + cycle_cost
+        cost[..., self.col_slice('buy_from_grid')] = purchase_price
+        cost[..., self.col_slice('charge_from_pv')] = cycle_cost
+        cost[..., self.col_slice('use_battery')] = cycle_cost
+        if sell_prices is None:
+            cost[..., self.col_slice('sell_pv')] = -self.params['feed_in_tariff']
+        else:
+            cost[..., self.col_slice('sell_pv')] = -np.asarray(sell_prices, dtype=float)[..., :T]
+        cost[..., self.col_slice('peak')] = peak_charge / self.params['delta_t']
+
+        row_lower[..., self.row_slice('initial_soc')] = row_upper[..., self.row_slice('initial_soc')] = np.reshape(initial_soc, np.shape(initial_soc) + (1,))
+        row_upper[..., self.row_slice('pv_split')] = np.asarray(pv_output, dtype=float)[..., :T]
+        row_lower[..., self.row_slice('load_balance')] = row_upper[..., self.row_slice('load_balance')] = np.asarray(load_profile, dtype=float)[..., :T]
+
+    def save(self, file):
+        # Writes the structure (sparse constraint matrix in CSR form and column bounds) to an .npz file, the
+        # data dependent cost and row bounds are not stored
+        A = self.A.tocsr()
+        np.savez(
+            file, data=A.data, indices=A.indices, indptr=A.indptr, shape=A.shape, col_lower=self.col_lower,
+            col_upper=self.col_upper, time_steps=self.time_steps, fixed_purchase_price=self.fixed_purchase_price,
+            periods=np.empty(0) if self.periods is None else self.periods
+        )
+
+    @classmethod
+    def load(cls, file, params):
+        # DispatchLP of a file written by save, params must match the battery parameters it was built with
+        with np.load(file) as model:
+            lp = cls.__new__(cls)
+            periods = model['periods'] if len(model['periods']) else None
+            lp._set_shape(int(model['time_steps']), params, bool(model['fixed_purchase_price']), periods)
+            lp.A = sp.csr_matrix((model['data'], model['indices'], model['indptr']), shape=tuple(model['shape']))
+            lp.col_lower = model['col_lower']
+            lp.col_upper = model['col_upper']
+        if lp.A.shape != (lp.num_rows, lp.num_cols):
+            raise ValueError("Model file does not match its horizon")
+        lp._init_rows()
+        return lp
+
+    def solve(self):
+        return solve_lp(self.cost, self.A_eq, self.A_ub, self.row_lower, self.row_upper, self.eq_rows, self.col_lower, self.col_upper)
+
+    def unpack(self, x):
+        # Views of the solution vector, NaN if no solution is available
+        return DispatchResults.from_solution(x, self.time_steps)
+
+
+class PersistentSolver:
+    # Keeps one HiGHS instance loaded with the structure of a DispatchLP. Before each solve only the cost
+    # coefficients and bounds that differ from the previous solve are pushed, so HiGHS keeps its previous basis
+    # and warm-starts the simplex. Without the optional highspy package every solve falls back to a cold linprog
+    # call.
+    def __init__(self, lp):
+        self.lp = lp
+        try:
+            import highspy
+        except ImportError:
+            self.highs = None
+            return
+
+        self.highs = highspy.Highs()
+        self.highs.setOptionValue('output_flag', False)
+        A = lp.A.tocsc()
+        model = highspy.HighsLp()
+        model.num_col_ = lp.num_cols
+        model.num_row_ = lp.num_rows
+        model.col_cost_ = lp.cost
+        model.col_lower_ = lp.col_lower
+        model.col_upper_ = lp.col_upper
+        model.row_lower_ = lp.row_lower
+        model.row_upper_ = lp.row_upper
+        model.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        model.a_matrix_.start_ = A.indptr
+        model.a_matrix_.index_ = A.indices
+        model.a_matrix_.value_ = A.data
+        self.highs.passModel(model)
+        self.optimal_status = highspy.HighsModelStatus.kOptimal
+        # linprog status codes of the non-optimal model states, anything else counts as numerical difficulties
+        self.status_codes = {
+            highspy.HighsModelStatus.kIterationLimit: 1,
+            highspy.HighsModelStatus.kTimeLimit: 1,
+            highspy.HighsModelStatus.kInfeasible: 2,
+            highspy.HighsModelStatus.kUnbounded: 3,
+            highspy.HighsModelStatus.kUnboundedOrInfeasible: 3,
+        }
+        # Values held by the HiGHS model, compared against the DispatchLP arrays before every solve
+        self.pushed = {key: getattr(lp, key).copy() for key in ('cost', 'col_lower', 'col_upper', 'row_lower', 'row_upper')}
+
+    def write_model(self, path):
+        # Exports the model HiGHS holds (data of the last solve) in the format of the file extension, e.g. .mps
+        if self.highs is None:
+            raise RuntimeError("Model export requires highspy")
+        self.highs.writeModel(path)
+
+    def _changed(self, *keys):
+        changed = np.zeros(len(getattr(self.lp, keys[0])), dtype=bool)
+        for key in keys:
+            changed |= getattr(self.lp, key) != self.pushed[key]
+            self.pushed[key][:] = getattr(self.lp, key)
+        return np.flatnonzero(changed).astype(np.int32)
+
+    def solve(self):
+        if self.highs is None:
+            return self.lp.solve()
+
+        lp = self.lp
+        cols = self._changed('cost')
+        if len(cols):
+            self.highs.changeColsCost(len(cols), cols, lp.cost[cols])
+        cols = self._changed('col_lower', 'col_upper')
+        if len(cols):
+            self.highs.changeColsBounds(len(cols), cols, lp.col_lower[cols], lp.col_upper[cols])
+        rows = self._changed('row_lower', 'row_upper')
+        if len(rows):
+            self.highs.changeRowsBounds(len(rows), rows, lp.row_lower[rows], lp.row_upper[rows])
+        self.highs.run()
+
+        model_status = self.highs.getModelStatus()
+        info = self.highs.getInfo()
+        success = model_status == self.optimal_status
+        return OptimizeResult(
+            x=np.array(self.highs.getSolution().col_value) if success else None,
+            fun=info.objective_function_value if success else None,
+            success=success,
+            status=0 if success else self.status_codes.get(model_status, 4),
+            message=self.highs.modelStatusToString(model_status),
+            nit=info.simplex_iteration_count
+        )
+
+
+def dispatch_lp(time_steps, params, fixed_purchase_price=False, periods=None, model_store=None):
+    # DispatchLP from the optional ModelStore (loaded if it was built before), otherwise built directly
+    if model_store is not None:
+        return model_store.get(time_steps, params, fixed_purchase_price, periods)
+    return DispatchLP(time_steps, params, fixed_purchase_price, periods)
+
+
+def solve_dispatch_lp(prices, pv_output, load_profile, params, fixed_purchase_price=False, initial_soc=None, telemetry=None, tariff=None, model_store=None):
+    # tariff: optional TariffSeries, its sell prices replace feed_in_tariff and its peak-demand charge adds the
+    # peak columns (prices are expected to be its buy prices)
+    start = time.perf_counter()
+    if tariff is None:
+        lp = dispatch_lp(len(prices), params, fixed_purchase_price, model_store=model_store)
+        lp.set_data(prices, pv_output, load_profile, initial_soc)
+    else:
+        lp = dispatch_lp(len(prices), params, fixed_purchase_price, tariff.periods if tariff.has_peak_charge else None, model_store)
+        lp.set_data(prices, pv_output, load_profile, initial_soc, tariff.sell, tariff.peak_charge)
+    build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    res = lp.solve()
+    if telemetry is not None:
+        telemetry.record(
+            window=0, start=0, end=len(prices), num_variables=lp.num_cols, num_constraints=lp.num_rows,
+            build_seconds=build_seconds, solve_seconds=time.perf_counter() - start, **result_fields(res)
+        )
+    return lp.unpack(res.x)
@@ -0,0 +1,125 @@
+import numpy as np
+
+# Per-timestep flows of a dispatch result, in the column order of DispatchLP, followed by the SOC chain
+FLOW_KEYS = ['charge_from_grid', 'buy_from_grid', 'charge_from_pv', 'use_pv', 'use_battery', 'sell_pv']
+RESULT_KEYS = FLOW_KEYS + ['soc']
+
+
+class DispatchResults:
+    # Dispatch result of one household as two contiguous arrays instead of a dict of lists:
+    #   flows: (len(FLOW_KEYS), time_steps), one row per flow in FLOW_KEYS order
+    #   soc:   (time_steps + 1,), SOC at the start of every step plus the final SOC
+    #   timestamps: optional time stamps of the steps
+    # results['use_pv'] etc. return views, so existing dict-style code keeps working without copies. Built from
+    # a DispatchLP solution vector (from_solution) both arrays are views of it, window() returns views as well.
+    __slots__ = ('flows', 'soc', 'timestamps')
+
+    def __init__(self, flows, soc, timestamps=None):
+        self.flows = flows
+        self.soc = soc
+        self.timestamps = timestamps
+        if flows.shape != (len(FLOW_KEYS), len(soc) - 1):
+            raise ValueError("flows must have shape (len(FLOW_KEYS), time_steps) and soc time_steps + 1 values")
+
+    @classmethod
+    def empty(cls, time_steps, initial_soc=np.nan, dtype=np.float64, timestamps=None):
+        # NaN filled, e.g. to be filled window by window with put()
+        soc = np.full(time_steps + 1, np.nan, dtype=dtype)
+        soc[0] = initial_soc
+        return cls(np.full((len(FLOW_KEYS), time_steps), np.nan, dtype=dtype), soc, timestamps)
+
+    @classmethod
+    def from_solution(cls, x, time_steps):
+        # Views of a solution vector in DispatchLP column order, x=None (no solution) gives NaN
+        if x is None:
+            return cls.empty(time_steps)
+        x = np.asarray(x)
+        flows_end = len(FLOW_KEYS) * time_steps
+        return cls(x[:flows_end].reshape(len(FLOW_KEYS), time_steps), x[flows_end:flows_end + time_steps + 1])
+
+    @classmethod
+    def from_dict(cls, results, dtype=np.float64, timestamps=None):
+        flows = np.array([results[key] for key in FLOW_KEYS], dtype=dtype)
+        return cls(flows, np.asarray(results['soc'], dtype=dtype), timestamps)
+
+    @property
+    def time_steps(self):
+        return self.flows.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.flows.nbytes + self.soc.nbytes
+
+    def __getitem__(self, key):
+        if key == 'soc':
+            return self.soc
+        try:
+            return self.flows[FLOW_KEYS.index(key)]
+        except ValueError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, values):
+        self[key][:] = values
+
+    def __contains__(self, key):
+        return key in RESULT_KEYS
+
+    def __iter__(self):
+        return iter(RESULT_KEYS)
+
+    def keys(self):
+        return list(RESULT_KEYS)
+
+    def values(self):
+        return [self[key] for key in RESULT_KEYS]
+
+    def items(self):
+        return [(key, self[key]) for key in RESULT_KEYS]
+
+    def get(self, key, default=None):
+        return self[key] if key in RESULT_KEYS else default
+
+    def __repr__(self):
+        return f"DispatchResults(time_steps={self.time_steps}, dtype={self.flows.dtype})"
+
+    def window(self, start, end):
+        # Steps start..end-1 as views, soc keeps its start value (end - start + 1 values)
+        timestamps = None if self.timestamps is None else self.timestamps[start:end]
+        return DispatchResults(self.flows[:, start:end], self.soc[start:end + 1], timestamps)
+
+    def put(self, start, window, steps=None):
+        # Copies the first steps (default: all) steps of window into steps start.. of this result, the SOC at
+        # step start is taken from here, the following SOC values from window
+        steps = window.time_steps if steps is None else steps
+        self.flows[:, start:start + steps] = window.flows[:, :steps]
+        self.soc[start + 1:start + steps + 1] = window.soc[1:steps + 1]
+
+    def invalidate(self):
+        # Marks the whole result as not solved
+        self.flows[:] = np.nan
+        self.soc[:] = np.nan
+
+    def astype(self, dtype):
+        # Copy with another dtype, e.g. np.float32 to halve the memory of stored results
+        return DispatchResults(self.flows.astype(dtype), self.soc.astype(dtype), self.timestamps)
+
+    def to_dict(self):
+        # Plain dict of array views
+        return dict(self.items())
+
+    def to_pandas(self):
+        # DataFrame with one row per step (SOC at the end of the step), the columns are views of the arrays
+        import pandas as pd
+        columns = {key: self.flows[i] for i, key in enumerate(FLOW_KEYS)}
+        columns['soc'] = self.soc[1:]
+        index = None if self.timestamps is None else pd.Index(self.timestamps, name='timestamp')
+        return pd.DataFrame(columns, index=index, copy=False)
+
+    def to_arrow(self):
+        # pyarrow Table with one row per step (SOC at the end of the step), contiguous float columns are not copied
+        import pyarrow
+        columns = {key: pyarrow.array(self.flows[i]) for i, key in enumerate(FLOW_KEYS)}
+        columns['soc'] = pyarrow.array(self.soc[1:])
+        if self.timestamps is not None:
+            columns = {'timestamp': pyarrow.array(np.asarray(self.timestamps)), **columns}
+        return pyarrow.table(columns)
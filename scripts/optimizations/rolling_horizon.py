@@ -0,0 +1,67 @@
+import time
+
+import numpy as np
+
+from scripts.optimizations.matrix_model import PersistentSolver, dispatch_lp
+from scripts.optimizations.results import DispatchResults
+from scripts.optimizations.telemetry import result_fields
+
+
+class RollingHorizon:
+    # Rolling-horizon dispatch: every window looks ahead horizon_steps, but only the first commit_steps are
+    # kept before the window moves on. The window model is built once per window length and reused, each window
+    # only updates prices, PV output, load profile and initial SOC and warm-starts from the previous basis.
+    # A window without an optimal solution is committed as NaN and the next window starts from the last known SOC.
+    def __init__(self, params, horizon_steps=24, commit_steps=24, fixed_purchase_price=False, telemetry=None, model_store=None):
+        if commit_steps < 1 or horizon_steps < commit_steps:
+            raise ValueError("Horizon must be at least as long as the commit length")
+        self.params = params
+        self.horizon_steps = horizon_steps
+        self.commit_steps = commit_steps
+        self.fixed_purchase_price = fixed_purchase_price
+        self.solvers = {}  # window length -> PersistentSolver
+        self.telemetry = telemetry  # Optional Telemetry, records every window solve
+        self.model_store = model_store  # Optional ModelStore the window models are loaded from
+
+    def _solver(self, window_steps):
+        if window_steps not in self.solvers:
+            self.solvers[window_steps] = PersistentSolver(dispatch_lp(window_steps, self.params, self.fixed_purchase_price, model_store=self.model_store))
+        return self.solvers[window_steps]
+
+    def windows(self, time_steps):
+        for start in range(0, time_steps, self.commit_steps):
+            yield start, min(start + self.horizon_steps, time_steps), min(start + self.commit_steps, time_steps)
+
+    def solve_window(self, start, end, prices, pv_output, load_profile, initial_soc):
+        build_start = time.perf_counter()
+        solver = self._solver(end - start)
+        solver.lp.set_data(prices[start:end], pv_output[start:end], load_profile[start:end], initial_soc)
+        solve_start = time.perf_counter()
+        res = solver.solve()
+        if self.telemetry is not None:
+            self.telemetry.record(
+                window=start // self.commit_steps, start=start, end=end,
+                num_variables=solver.lp.num_cols, num_constraints=solver.lp.num_rows,
+                build_seconds=solve_start - build_start, solve_seconds=time.perf_counter() - solve_start,
+                **result_fields(res)
+            )
+        return solver.lp.unpack(res.x)
+
+    def run(self, prices, pv_output, load_profile, initial_soc=None, on_commit=None):
+        # on_commit(start, chunk) is called with the committed part of every window (a DispatchResults view),
+        # e.g. ResultsWriter.on_commit(...)
+        if initial_soc is None:
+            initial_soc = self.params['initial_soc']
+        results = DispatchResults.empty(len(prices), initial_soc)
+        soc = initial_soc
+
+        for start, end, commit_end in self.windows(len(prices)):
+            window = self.solve_window(start, end, prices, pv_output, load_profile, soc)
+            committed = commit_end - start
+            if not np.isnan(window.soc[committed]):
+                soc = window.soc[committed]
+            results.put(start, window, committed)
+            if on_commit is not None:
+                on_commit(start, window.window(0, committed))
+
+        return results
@@ -0,0 +1,137 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+
+from scripts.optimizations.matrix_model import DispatchLP, FLOW_KEYS, solve_lp
+from scripts.optimizations.fast_dispatch import stage_cost
+from scripts.optimizations.telemetry import Telemetry, result_fields
+
+
+def evaluate_schedule(charge, discharge, prices, pv_outputs, load_profiles, params, fixed_purchase_price=False):
+    # Cost of a fixed battery schedule (charge / discharge power per time step, shape (T,) or (S, T)) in every
+    # scenario of the (S, T) ensemble. The recourse is the cheapest PV split and grid purchase for the resulting
+    # net demand, in closed form as in FastDispatch. The battery only supplies the load, scheduled discharge above
+    # the load of a scenario is not possible there and is reported as shortfall (kWh) instead of being costed.
+    delta_t = params['delta_t']
+    load_profiles = np.atleast_2d(np.asarray(load_profiles, dtype=float))
+    pv_outputs = np.atleast_2d(np.asarray(pv_outputs, dtype=float))
+    if fixed_purchase_price:
+        purchase_price = np.full(load_profiles.shape, params['reference_fixed_price'])
+    else:
+        purchase_price = np.broadcast_to(np.asarray(prices, dtype=float), load_profiles.shape)
+
+    discharge = np.broadcast_to(np.asarray(discharge, dtype=float), load_profiles.shape)
+    delivered = np.minimum(discharge, load_profiles)
+    net_demand = np.asarray(charge, dtype=float) - delivered + load_profiles
+    cost = stage_cost(net_demand, pv_outputs, purchase_price, params)
+    cost = cost + params.get('cycle_cost', 0.0) * (np.asarray(charge, dtype=float) + delivered)
+    return {
+        'cost': cost.sum(axis=1),
+        'shortfall': (discharge - delivered).sum(axis=1) * delta_t,
+    }
+
+
+def _evaluate_chunk(args):
+    return evaluate_schedule(*args)
+
+
+class ScenarioOptimization:
+    # Two-stage dispatch against an ensemble of S price / PV / load trajectories (arrays of shape (S, T), a
+    # single (T,) price curve is shared by all scenarios).
+    #   probabilities: scenario weights, uniform by default
+    #   first_stage_steps: number of leading time steps whose battery charge and discharge power is shared by
+    #                      all scenarios (the schedule that is committed now), T by default
+    # Every scenario gets its own copy of the DispatchLP variables (recourse: PV split, grid purchase, feed-in
+    # and the battery after the first stage), the objective is the expected cost. Non-anticipativity rows tie the
+    # first-stage battery powers of every scenario to those of the first scenario. As all scenarios share the
+    # battery parameters, the block-diagonal matrix, cost vector and row bounds are assembled for all scenarios at
+    # once (Kronecker product / DispatchLP.fill over the scenario axis) instead of per scenario or per time step.
+    def __init__(self, prices, pv_outputs, load_profiles, params, probabilities=None, first_stage_steps=None, fixed_purchase_price=False, telemetry=None):
+        self.pv_outputs = np.atleast_2d(np.asarray(pv_outputs, dtype=float))
+        self.load_profiles = np.atleast_2d(np.asarray(load_profiles, dtype=float))
+        self.scenarios, self.time_steps = np.broadcast_shapes(self.pv_outputs.shape, self.load_profiles.shape, np.shape(prices))
+        self.pv_outputs = np.broadcast_to(self.pv_outputs, (self.scenarios, self.time_steps))
+        self.load_profiles = np.broadcast_to(self.load_profiles, (self.scenarios, self.time_steps))
+        self.prices = np.broadcast_to(np.asarray(prices, dtype=float), (self.scenarios, self.time_steps))
+        if probabilities is None:
+            probabilities = np.full(self.scenarios, 1 / self.scenarios)
+        self.probabilities = np.asarray(probabilities, dtype=float)
+        if len(self.probabilities) != self.scenarios or not np.isclose(self.probabilities.sum(), 1.0):
+            raise ValueError("probabilities must have one entry per scenario and sum to 1")
+        self.first_stage_steps = self.time_steps if first_stage_steps is None else int(first_stage_steps)
+        if not 0 <= self.first_stage_steps <= self.time_steps:
+            raise ValueError("first_stage_steps must be between 0 and the number of time steps")
+        self.params = params
+        self.fixed_purchase_price = fixed_purchase_price
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+
+    def _non_anticipativity(self, lp):
+        # Rows (charge_from_grid + charge_from_pv)[t] and use_battery[t] of scenario s minus those of scenario 0
+        F = self.first_stage_steps
+        columns = np.arange(lp.num_cols)
+        charge = sp.csr_matrix(
+            (np.ones(2 * F), (np.tile(np.arange(F), 2), np.concatenate([columns[lp.col_slice('charge_from_grid')][:F], columns[lp.col_slice('charge_from_pv')][:F]]))),
+            shape=(F, lp.num_cols)
+        )
+        discharge = sp.csr_matrix((np.ones(F), (np.arange(F), columns[lp.col_slice('use_battery')][:F])), shape=(F, lp.num_cols))
+        difference = sp.hstack([-np.ones((self.scenarios - 1, 1)), sp.identity(self.scenarios - 1)])
+        return sp.kron(difference, sp.vstack([charge, discharge]), format='csr')
+
+    def optimize(self):
+        build_start = time.perf_counter()
+        S = self.scenarios
+        lp = DispatchLP(self.time_steps, self.params, self.fixed_purchase_price)
+        cost = np.tile(lp.cost, (S, 1))
+        row_lower = np.tile(lp.row_lower, (S, 1))
+        row_upper = np.tile(lp.row_upper, (S, 1))
+        lp.fill(cost, row_lower, row_upper, self.prices, self.pv_outputs, self.load_profiles)
+
+        blocks = sp.identity(S, format='csr')
+        A_eq = sp.kron(blocks, lp.A_eq, format='csr')
+        A_ub = sp.kron(blocks, lp.A_ub, format='csr')
+        eq_rows = np.tile(lp.eq_rows, S)
+        row_lower, row_upper = row_lower.ravel(), row_upper.ravel()
+        if S > 1 and self.first_stage_steps > 0:
+            non_anticipativity = self._non_anticipativity(lp)
+            A_eq = sp.vstack([A_eq, non_anticipativity], format='csr')
+            row_lower = np.concatenate([row_lower, np.zeros(non_anticipativity.shape[0])])
+            row_upper = np.concatenate([row_upper, np.zeros(non_anticipativity.shape[0])])
+            eq_rows = np.concatenate([eq_rows, np.ones(non_anticipativity.shape[0], dtype=bool)])
+
+        solve_start = time.perf_counter()
+        res = solve_lp(
+            (cost * self.probabilities[:, None]).ravel(), A_eq, A_ub, row_lower, row_upper, eq_rows,
+            np.tile(lp.col_lower, S), np.tile(lp.col_upper, S)
+        )
+        self.telemetry.record(
+            window=0, start=0, end=self.time_steps, num_variables=S * lp.num_cols, num_constraints=len(row_lower),
+            build_seconds=solve_start - build_start, solve_seconds=time.perf_counter() - solve_start, **result_fields(res)
+        )
+
+        # Per-scenario results of shape (S, T), soc (S, T + 1), NaN without a solution
+        x = res.x.reshape(S, lp.num_cols) if res.x is not None else np.full((S, lp.num_cols), np.nan)
+        results = {key: x[:, lp.col_slice(key)] for key in FLOW_KEYS + ['soc']}
+        results['expected_cost'] = res.fun if res.success else np.nan
+        return results
+
+    def evaluate(self, charge, discharge, max_workers=1):
+        # Cost and shortfall of a battery schedule in every scenario, see evaluate_schedule. With max_workers > 1
+        # (or None for all CPUs) the scenarios are split into chunks that are evaluated in worker processes.
+        charge = np.broadcast_to(np.asarray(charge, dtype=float), (self.scenarios, self.time_steps))
+        discharge = np.broadcast_to(np.asarray(discharge, dtype=float), (self.scenarios, self.time_steps))
+        if max_workers == 1:
+            evaluation = evaluate_schedule(charge, discharge, self.prices, self.pv_outputs, self.load_profiles, self.params, self.fixed_purchase_price)
+        else:
+            chunks = np.array_split(np.arange(self.scenarios), max_workers or os.cpu_count() or 1)
+            tasks = [
+                (charge[chunk], discharge[chunk], self.prices[chunk], self.pv_outputs[chunk], self.load_profiles[chunk], self.params, self.fixed_purchase_price)
+                for chunk in chunks if len(chunk)
+            ]
+            with ProcessPoolExecutor(max_workers) as executor:
+                parts = list(executor.map(_evaluate_chunk, tasks))
+            evaluation = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+        evaluation['expected_cost'] = float(self.probabilities @ evaluation['cost'])
+        return evaluation
@@ -0,0 +1,64 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Status strings of scipy.optimize.linprog result codes, PuLP reports LpStatus strings with the same wording
+LINPROG_STATUS = {0: 'Optimal', 1: 'Iteration limit', 2: 'Infeasible', 3: 'Unbounded', 4: 'Numerical difficulties'}
+
+
+def result_fields(res):
+    # Status, objective value and iteration count of a linprog / PersistentSolver result
+    return {
+        'status': 'Optimal' if res.success else LINPROG_STATUS.get(res.status, str(res.message)),
+        'objective': float(res.fun) if res.success else None,
+        'iterations': int(res.nit) if getattr(res, 'nit', None) is not None else None,
+    }
+
+
+class Telemetry:
+    # Collects one record per solve (one per window in day-ahead mode) with the model size, build and solve time,
+    # solver status, objective value and iteration count. Every record is passed to the callbacks as it is added
+    # and logged as a JSON line on the "scripts.optimizations.telemetry" logger (DEBUG, WARNING for solves that
+    # did not end optimal). context is added to every record, e.g. the scenario of a sweep.
+    def __init__(self, callbacks=None, context=None):
+        self.callbacks = list(callbacks or [])
+        self.context = dict(context or {})
+        self.records = []
+
+    def record(self, **fields):
+        record = dict(self.context)
+        record.update(fields)
+        self.records.append(record)
+        if record['status'] == 'Optimal':
+            logger.debug(json.dumps(record, default=float))
+        else:
+            logger.warning(json.dumps(record, default=float))
+        for callback in self.callbacks:
+            callback(record)
+        return record
+
+    @property
+    def failed(self):
+        return [record for record in self.records if record['status'] != 'Optimal']
+
+    def summary(self):
+        # Totals over all records, e.g. as extra columns of a sweep summary
+        return {
+            'solves': len(self.records),
+            'failed_solves': len(self.failed),
+            'build_seconds': sum(record['build_seconds'] for record in self.records),
+            'solve_seconds': sum(record['solve_seconds'] for record in self.records),
+            'iterations': sum(record['iterations'] or 0 for record in self.records),
+        }
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.records)
+
+    def write_jsonl(self, path, mode='a'):
+        # One JSON object per line, appended by default so several runs can share one log file
+        with open(path, mode) as file:
+            for record in self.records:
+                file.write(json.dumps(record, default=float) + '\n')
+        return path
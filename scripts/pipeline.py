@@ -0,0 +1,43 @@
+import numpy as np
+
+from scripts.utils.calculate_profit import (
+    calculate_battery_profit, calculate_pv_profit, calculate_investment_costs,
+    calculate_effective_profit_buy, calculate_total_profit, calculate_peak_demand_cost
+)
+from scripts.utils.projection import discount_factors
+
+# Dispatch series the profit calculation needs, stacked per year with degradation
+PROFIT_KEYS = ('charge_from_grid', 'buy_from_grid', 'sell_pv')
+
+
+def run_dispatch(optimizer, X, degradation=False, result_cache=None):
+    # Dispatch of a BatteryOptimization as used by scripts.main and run_sweep. Returns the results of the input
+    # year, the dispatch the profit calculation uses (one row per year of the projection with degradation) and
+    # the battery capacity of every year (None without degradation). result_cache: optional ResultCache.
+    if degradation:
+        # One dispatch per year of the projection with the faded capacity, results holds the first year
+        dispatch = optimizer.degradation(X)
+        yearly = dispatch.run()
+        return yearly[0], {key: np.stack([year[key] for year in yearly]) for key in PROFIT_KEYS}, dispatch.capacities
+    if result_cache is not None:
+        # Identical dispatch problems (e.g. scenarios that only differ in investment costs) are solved only once
+        results = result_cache.optimize(optimizer)
+    else:
+        results = optimizer.optimize()
+    return results, results, None
+
+
+def calculate_profits(params, prices, dispatch, X, fixed_purchase_price=False, tariff=None):
+    # Cumulative profits of the X-year projection of a dispatch (see run_dispatch), prices are the buy prices
+    # (optimizer.prices), tariff an optional TariffSeries
+    battery_investment_cost, pv_investment_cost, power_electronics_cost = calculate_investment_costs(params)
+    delta_t = params['delta_t']
+    year_factors = discount_factors(params, X)
+    profits = {
+        'battery': calculate_battery_profit(prices, dispatch['charge_from_grid'], delta_t, battery_investment_cost, X, year_factors),
+        'pv': calculate_pv_profit(dispatch['sell_pv'], delta_t, pv_investment_cost, X, params['feed_in_tariff'] if tariff is None else tariff.sell, year_factors),
+        'purchase': calculate_effective_profit_buy(params, prices, dispatch['buy_from_grid'], delta_t, X, fixed_purchase_price, year_factors),
+        'peak_demand_cost': 0 if tariff is None else calculate_peak_demand_cost(tariff, dispatch['charge_from_grid'], dispatch['buy_from_grid'], X, year_factors),
+    }
+    profits['total'] = calculate_total_profit(profits['battery'], profits['pv'], profits['purchase'], power_electronics_cost, profits['peak_demand_cost'])
+    return profits
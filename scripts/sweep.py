@@ -0,0 +1,166 @@
+import os
+import calendar
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from scripts.utils.data_cache import load_data_cached
+from scripts.optimizations.battery_operation import BatteryOptimization
+from scripts.optimizations.telemetry import Telemetry
+from scripts.pipeline import run_dispatch, calculate_profits
+from scripts.utils.params_loader import load_params
+from scripts.utils.normalizer import normalize_data
+from scripts.utils.results_writer import ResultsWriter
+from scripts.utils.result_cache import ResultCache
+from scripts.utils.model_store import ModelStore
+from scripts.utils.tariff import Tariff, local_start
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+# Keys of a sweep grid that are not entries of params.csv
+SETTING_KEYS = ('year', 'fixed_purchase_price', 'optimization_type')
+
+# Shared by all scenarios of a worker process, filled once by _init_worker
+_shared = {}
+
+
+def expand_grid(grid):
+    # {'battery_capacity_max': [5, 10], 'year': ['2023']} -> [{'battery_capacity_max': 5, 'year': '2023'}, ...]
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def load_inputs(years, data_dir=DATA_DIR, delta_t=1.0):
+    # Raw (not normalized) input arrays per year, read once and shared with all workers
+    inputs = {}
+    for year in years:
+        year_dir = os.path.join(data_dir, str(year))
+        inputs[str(year)] = load_data_cached(
+            os.path.join(year_dir, 'price_data.csv'),
+            os.path.join(year_dir, 'pv_data.csv'),
+            os.path.join(year_dir, 'load_profile.csv'),
+            calendar.isleap(int(year)),
+            delta_t
+        )
+    return inputs
+
+
+def load_tariffs(inputs, tariff, base_params, pv_integration, price_scaling):
+    # TariffSeries per year, computed once and shared with all workers instead of once per scenario
+    tariffs = {}
+    for year, (prices, pv_output, load_profile, timestamps) in inputs.items():
+        spot_prices = normalize_data(prices, pv_output, load_profile, base_params, pv_integration, price_scaling)[0]
+        tariffs[year] = Tariff(**tariff).series(spot_prices, local_start(timestamps), base_params)
+    return tariffs
+
+
+def _init_worker(inputs, base_params, settings, tariffs=None):
+    _shared['inputs'] = inputs
+    _shared['base_params'] = base_params
+    _shared['settings'] = settings
+    _shared['tariffs'] = tariffs or {}
+    _shared['model_store'] = ModelStore(settings['model_dir']) if settings.get('model_dir') is not None else None
+
+
+def run_scenario(scenario):
+    settings = dict(_shared['settings'])
+    settings.update({key: value for key, value in scenario.items() if key in SETTING_KEYS})
+    params = dict(_shared['base_params'])
+    params.update({key: value for key, value in scenario.items() if key not in SETTING_KEYS})
+    X = settings['X']
+    fixed_purchase_price = settings['fixed_purchase_price']
+
+    prices, pv_output, load_profile, timestamps = _shared['inputs'][str(settings['year'])]
+    prices, pv_output, load_profile = normalize_data(prices, pv_output, load_profile, params, settings['pv_integration'], settings['price_scaling'])
+    tariff = _shared['tariffs'].get(str(settings['year']))
+
+    telemetry = Telemetry(context=scenario)  # Failed windows are logged as warnings together with their scenario
+    optimizer = BatteryOptimization(prices, pv_output, load_profile, params, settings['optimization_type'], fixed_purchase_price, settings['backend'], telemetry=telemetry, tariff=tariff, model_store=_shared['model_store'],
+                                    timestamps=timestamps)
+    prices = optimizer.prices  # Buy prices of the tariff
+    result_cache = None
+    if settings['result_cache_dir'] is not None and not settings['degradation']:
+        result_cache = ResultCache(settings['result_cache_dir'], settings['result_cache_max_bytes'])
+    results, dispatch, capacities = run_dispatch(optimizer, X, settings['degradation'], result_cache)
+    capacity_final = params['battery_capacity_max'] if capacities is None else capacities[-1]
+
+    profits = calculate_profits(params, prices, dispatch, X, fixed_purchase_price, tariff)
+    total_profit = profits['total']
+
+    if settings['results_dir'] is not None:
+        # Time series of every scenario in its own partition, e.g. results_dir/battery_capacity_max=5/pv_capacity=10/
+        writer = ResultsWriter(settings['results_dir'], settings['results_format'])
+        writer.write(results, timestamps, prices, load_profile, total_profit, scenario)
+
+    delta_t = params['delta_t']
+    pv_generation = np.sum(pv_output) * delta_t
+    self_consumption = (np.sum(results['use_pv']) + np.sum(results['charge_from_pv'])) * delta_t
+    summary = dict(scenario)
+    summary.update({
+        'total_profit': total_profit.final,
+        'pv_generation': pv_generation,
+        'self_consumption': self_consumption,
+        'self_consumption_rate': self_consumption / pv_generation if pv_generation > 0 else np.nan,
+        'grid_import': (np.sum(results['buy_from_grid']) + np.sum(results['charge_from_grid'])) * delta_t,
+        'feed_in': np.sum(results['sell_pv']) * delta_t,
+        'peak_demand_cost': 0.0 if tariff is None else profits['peak_demand_cost'].final,
+        'capacity_final': capacity_final,
+    })
+    summary.update(telemetry.summary())  # solves, failed_solves, build_seconds, solve_seconds, iterations
+    return summary
+
+
+def run_sweep(grid, params_file_path=os.path.join(DATA_DIR, 'params.csv'), data_dir=DATA_DIR, year="2023",
+              battery_integration=True, pv_integration=True, fixed_purchase_price=False,
+              optimization_type="perfect_foresight", backend="highs", X=20, max_workers=None,
+              results_dir=None, results_format="parquet", result_cache_dir=None, result_cache_max_bytes=2**30,
+              tariff=None, price_scaling=None, degradation=False, model_dir=None):
+    # Runs every combination of the grid (params.csv overrides plus year / fixed_purchase_price /
+    # optimization_type) and returns one summary row per scenario. tariff: keyword arguments of Tariff, its
+    # prices are computed once per year from the base params, price_scaling: see normalize_data (default
+    # 'eur_per_kwh' with a tariff, 'min_max' otherwise), degradation: dispatch every year with the faded capacity, model_dir: ModelStore
+    # directory, every model structure is built once and loaded by all workers
+    scenarios = expand_grid(grid)
+    if tariff is not None and tariff.get('feed_in_tariff') is None and any('feed_in_tariff' in scenario for scenario in scenarios):
+        raise ValueError("Set feed_in_tariff in the tariff settings, tariff prices are not recomputed per scenario")
+    if price_scaling is None:
+        price_scaling = 'eur_per_kwh' if tariff is not None else 'min_max'
+    base_params = load_params(params_file_path, battery_integration, pv_integration)
+    settings = {
+        'year': year,
+        'fixed_purchase_price': fixed_purchase_price,
+        'optimization_type': optimization_type,
+        'pv_integration': pv_integration,
+        'backend': backend,
+        'X': X,
+        'results_dir': results_dir,
+        'results_format': results_format,
+        'result_cache_dir': result_cache_dir,
+        'result_cache_max_bytes': result_cache_max_bytes,
+        'price_scaling': price_scaling,
+        'degradation': degradation,
+        'model_dir': model_dir,
+    }
+    years = {str(scenario.get('year', year)) for scenario in scenarios}
+    inputs = load_inputs(sorted(years), data_dir, base_params['delta_t'])
+    tariffs = load_tariffs(inputs, tariff, base_params, pv_integration, price_scaling) if tariff is not None else None
+
+    if max_workers == 1:
+        _init_worker(inputs, base_params, settings, tariffs)
+        rows = [run_scenario(scenario) for scenario in scenarios]
+    else:
+        with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(inputs, base_params, settings, tariffs)) as executor:
+            rows = list(executor.map(run_scenario, scenarios, chunksize=max(1, len(scenarios) // (4 * (max_workers or os.cpu_count() or 1)))))
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    summary = run_sweep({
+        'battery_capacity_max': [0, 5, 10],
+        'charge_power_max': [2.5, 5],
+        'pv_capacity': [10, 25],
+    })
+    print(summary.to_string())
@@ -0,0 +1,42 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data', '.cache')
+ARRAY_NAMES = ('prices', 'pv_output', 'load_profile', 'timestamps')
+
+def _cache_key(file_paths, leap_year_switch, delta_t):
+    # Any change of a file (path, size, modification time) or of the loading options gives a new key
+    files = []
+    for path in file_paths:
+        stat = os.stat(path)
+        files.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+    key = json.dumps({'files': files, 'leap_year_switch': bool(leap_year_switch), 'delta_t': float(delta_t)})
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def load_data_cached(price_file_path, pv_file_path, load_profile_path, leap_year_switch=False, delta_t=1.0, cache_dir=CACHE_DIR, mmap=False):
+    # Same return values as load_data, the parsed arrays are stored as .npy files and reloaded (optionally
+    # memory-mapped read-only) as long as the CSV files are unchanged
+    cache_path = os.path.join(cache_dir, _cache_key((price_file_path, pv_file_path, load_profile_path), leap_year_switch, delta_t))
+
+    if os.path.isdir(cache_path):
+        return tuple(np.load(os.path.join(cache_path, f'{name}.npy'), mmap_mode='r' if mmap else None) for name in ARRAY_NAMES)
+
+    from scripts.utils.data_loader import load_data  # pandas is only needed on a cache miss
+    prices, pv_output, load_profile, timestamps = load_data(price_file_path, pv_file_path, load_profile_path, leap_year_switch, delta_t)
+    timestamps = np.asarray(timestamps).astype(str)  # Store as fixed-width strings instead of Python objects
+
+    # Write into a temporary directory first so concurrent workers never read a half-written entry
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=cache_dir)
+    for name, array in zip(ARRAY_NAMES, (prices, pv_output, load_profile, timestamps)):
+        np.save(os.path.join(tmp_path, f'{name}.npy'), np.asarray(array))
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)  # Another process stored the same entry in the meantime
+
+    return prices, pv_output, load_profile, timestamps
@@ -1,8 +1,21 @@
 import pandas as pd
 import numpy as np
 
-def load_data(price_file_path, pv_file_path, load_profile_path, leap_year_switch=False):
-    
+RAW_DELTA_T = 0.25  # Resolution of the PV and load profile files in hours, prices are hourly
+
+def resample(values, source_delta_t, target_delta_t):
+    # Mean over groups of steps when coarsening, repeat each value when refining
+    if target_delta_t >= source_delta_t:
+        group = int(round(target_delta_t / source_delta_t))
+        return pd.Series(values).groupby(np.arange(len(values)) // group).mean().values
+    return np.repeat(values, int(round(source_delta_t / target_delta_t)))
+
+def load_data(price_file_path, pv_file_path, load_profile_path, leap_year_switch=False, delta_t=1.0):
+    steps_per_group = int(round(delta_t / RAW_DELTA_T))
+    if delta_t < RAW_DELTA_T or not np.isclose(steps_per_group * RAW_DELTA_T, delta_t):
+        raise ValueError("delta_t must be a multiple of 0.25 hours")
+    steps_per_day = int(round(24 / delta_t))
+
     # Daten laden, erste Zeile überspringen
     price_data = pd.read_csv(price_file_path, skiprows=1).rename(columns={
         'Unnamed: 0': 'Datetime',
@@ -20,27 +33,27 @@ def load_data(price_file_path, pv_file_path, load_profile_path, leap_year_switch
     pv_data['PV Output (MW)'] = pd.to_numeric(pv_data['PV Output (MW)'], errors='coerce')
     load_profile_data['Wirkleistung [kW]'] = load_profile_data['Wirkleistung [kW]'].str.replace(',', '.').astype(float)
 
-    # Mittelwertbildung: jeweils 4 Werte zu einem zusammenfassen
-    pv_data['Group'] = pv_data.index // 4
+    # Mittelwertbildung: jeweils steps_per_group Werte zu einem zusammenfassen (4 bei stündlicher Auflösung)
+    pv_data['Group'] = pv_data.index // steps_per_group
     aggregated_pv_data = pv_data.groupby('Group').agg({
         'Datetime': 'first',  # Behalte den ersten Zeitstempel der Gruppe
         'PV Output (MW)': 'mean'  # Berechne den Mittelwert
     }).reset_index(drop=True)
 
-    # Mittelwertbildung für das Lastprofil: jeweils 4 Werte zu einem zusammenfassen
-    load_profile_data['Group'] = load_profile_data.index // 4
+    # Mittelwertbildung für das Lastprofil: jeweils steps_per_group Werte zu einem zusammenfassen
+    load_profile_data['Group'] = load_profile_data.index // steps_per_group
     aggregated_load_profile_data = load_profile_data.groupby('Group').agg({
         'Wirkleistung [kW]': 'mean'  # Berechne den Mittelwert
     }).reset_index(drop=True)
 
     # Handle leap year
     if leap_year_switch:
-        feb_28_values = aggregated_load_profile_data['Wirkleistung [kW]'][1344:1368]  # Get values for February 28th
-        aggregated_load_profile_data = np.insert(aggregated_load_profile_data['Wirkleistung [kW]'].values, 1368, feb_28_values)  # Insert February 28th values for February 29th
+        feb_28_values = aggregated_load_profile_data['Wirkleistung [kW]'][56 * steps_per_day:57 * steps_per_day]  # Get values for February 28th
+        aggregated_load_profile_data = np.insert(aggregated_load_profile_data['Wirkleistung [kW]'].values, 57 * steps_per_day, feb_28_values)  # Insert February 28th values for February 29th
         aggregated_load_profile_data = pd.DataFrame(aggregated_load_profile_data, columns=['Wirkleistung [kW]'])
 
     # Convert dataframes to NumPy arrays
-    prices = price_data['Price (EUR/MWh)'].values
+    prices = resample(price_data['Price (EUR/MWh)'].values, 1.0, delta_t)
     pv_output = aggregated_pv_data['PV Output (MW)'].values
     load_profile = aggregated_load_profile_data['Wirkleistung [kW]'].values
     timestamps = aggregated_pv_data['Datetime'].values
@@ -0,0 +1,75 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+from scripts.utils.data_cache import CACHE_DIR
+from scripts.optimizations.matrix_model import DispatchLP
+
+MODEL_DIR = os.path.join(CACHE_DIR, 'models')
+# params entries the structure of a DispatchLP depends on (constraint matrix and column bounds)
+STRUCTURE_PARAMS = (
+    'delta_t', 'efficiency', 'charge_power_max', 'discharge_power_max', 'grid_power_max', 'pv_capacity',
+    'battery_capacity_min', 'battery_capacity_max',
+)
+
+
+class ModelStore:
+    # On-disk store of DispatchLP structures (see DispatchLP.save), keyed by horizon length, structure params,
+    # fixed purchase price and billing periods. A model is built once, by whichever process asks for it first, and
+    # every later optimization (or worker process) loads it and only writes its data into the cost vector and row
+    # bounds. Loaded models are also kept in memory for the lifetime of the store.
+    def __init__(self, model_dir=MODEL_DIR):
+        self.model_dir = model_dir
+        self.models = {}
+        self.loaded = 0
+        self.built = 0
+
+    @staticmethod
+    def key(time_steps, params, fixed_purchase_price=False, periods=None):
+        digest = hashlib.sha1()
+        settings = {
+            'time_steps': int(time_steps),
+            'params': {key: params.get(key) for key in STRUCTURE_PARAMS},
+            'fixed_purchase_price': bool(fixed_purchase_price),
+        }
+        digest.update(json.dumps(settings, sort_keys=True, default=float).encode('utf-8'))
+        if periods is not None:
+            periods = np.asarray(periods)[:time_steps]
+            digest.update(np.ascontiguousarray(periods - periods[0], dtype=np.int64).tobytes())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.model_dir, f'{key}.npz')
+
+    def get(self, time_steps, params, fixed_purchase_price=False, periods=None):
+        # Fresh DispatchLP (own cost and row bound arrays) of the stored structure, built and stored if missing
+        key = self.key(time_steps, params, fixed_purchase_price, periods)
+        if key not in self.models:
+            try:
+                self.models[key] = DispatchLP.load(self.path(key), params)
+                self.loaded += 1
+            except (OSError, ValueError, KeyError):
+                self.models[key] = DispatchLP(time_steps, params, fixed_purchase_price, periods)
+                self.built += 1
+                self.put(key, self.models[key])
+        return self.copy(self.models[key], params)
+
+    @staticmethod
+    def copy(lp, params):
+        # Shares the (read-only) constraint matrix, copies the arrays that optimizations modify
+        model = DispatchLP.__new__(DispatchLP)
+        model.__dict__.update(lp.__dict__)
+        model.params = params
+        for name in ('col_lower', 'col_upper', 'cost', 'row_lower', 'row_upper'):
+            setattr(model, name, getattr(lp, name).copy())
+        return model
+
+    def put(self, key, lp):
+        # Write to a temporary file first so concurrent workers never load a half-written model
+        os.makedirs(self.model_dir, exist_ok=True)
+        file_descriptor, tmp_path = tempfile.mkstemp(dir=self.model_dir, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'wb') as file:
+            lp.save(file)
+        os.replace(tmp_path, self.path(key))
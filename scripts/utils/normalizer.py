@@ -1,22 +1,33 @@
-import numpy as np
-from sklearn.preprocessing import MinMaxScaler
-
-def normalize_data(prices, pv_output, load_profile, params, pv_integration):
-    # Normalize price data
-    price_scaler = MinMaxScaler()
-    prices = price_scaler.fit_transform(prices.reshape(-1, 1)).flatten()
-
-    # Normalize PV data if PV integration is enabled
-    if pv_integration:
-        pv_scaler = MinMaxScaler()
-        pv_output = pv_scaler.fit_transform(pv_output.reshape(-1, 1)).flatten()
-        # Scale mean PV output to 12% of the capacity (capacity factor)
-        pv_output *= params['pv_capacity'] * 0.12 * np.max(pv_output) / np.mean(pv_output)
-    else:
-        pv_output = np.zeros_like(pv_output)
-
-    # Normalize load profile to match annual consumption
-    annual_consumption = params['annual_consumption']
-    normalized_load_profile = load_profile * (annual_consumption / np.sum(load_profile))
-
-    return prices, pv_output, normalized_load_profile
+import numpy as np
+
+
+def min_max_scale(values):
+    # Scales values to [0, 1] like sklearn's MinMaxScaler, a constant series becomes all zeros
+    values = np.asarray(values, dtype=float)
+    value_range = np.max(values) - np.min(values)
+    return (values - np.min(values)) / (value_range if value_range != 0 else 1.0)
+
+
+def normalize_data(prices, pv_output, load_profile, params, pv_integration, price_scaling='min_max'):
+    # price_scaling: 'min_max' scales the prices to [0, 1], 'eur_per_kwh' keeps their values and converts them from
+    # EUR/MWh (the unit of the price files) to EUR/kWh, e.g. as spot prices of a Tariff, None leaves them as they are
+    if price_scaling == 'min_max':
+        prices = min_max_scale(prices)
+    elif price_scaling == 'eur_per_kwh':
+        prices = np.asarray(prices, dtype=float) / 1000
+    elif price_scaling is not None:
+        raise ValueError("Invalid price scaling")
+
+    # Normalize PV data if PV integration is enabled
+    if pv_integration:
+        pv_output = min_max_scale(pv_output)
+        # Scale mean PV output to 12% of the capacity (capacity factor)
+        pv_output *= params['pv_capacity'] * 0.12 * np.max(pv_output) / np.mean(pv_output)
+    else:
+        pv_output = np.zeros_like(pv_output)
+
+    # Normalize load profile (kW) to match annual consumption (kWh)
+    annual_consumption = params['annual_consumption']
+    normalized_load_profile = load_profile * (annual_consumption / (np.sum(load_profile) * params['delta_t']))
+
+    return prices, pv_output, normalized_load_profile
@@ -1,33 +1,34 @@
-import pandas as pd
-
-def load_params(params_file_path, battery_integration=True, pv_integration=True):
-    params_df = pd.read_csv(params_file_path)
-    params = {}
-
-    for index, row in params_df.iterrows():
-        key = row['Parameter']
-        value = row['Value']
-        try:
-            # Try to convert to float
-            value = float(value)
-        except ValueError:
-            # If conversion fails, keep as string
-            pass
-        params[key] = value
-
-    # Adjust parameters based on integration switches
-    if not battery_integration:
-        params['battery_capacity_max'] = 0
-        params['battery_investment_cost'] = 0
-        params['battery_fixed_cost'] = 0
-        params['charge_power_max'] = 0
-        params['discharge_power_max'] = 0
-        params['initial_soc'] = 0
-
-    if not pv_integration:
-        params['pv_capacity'] = 0
-        params['pv_investment_cost'] = 0
-        params['pv_fixed_cost'] = 0
-        params['feed_in_tariff'] = 0
-
+import csv
+
+def load_params(params_file_path, battery_integration=True, pv_integration=True):
+    params = {}
+
+    # Plain csv module instead of pandas to keep the import path light, utf-8-sig strips the byte order mark
+    with open(params_file_path, newline='', encoding='utf-8-sig') as file:
+        for row in csv.DictReader(file):
+            key = row['Parameter']
+            value = row['Value']
+            try:
+                # Try to convert to float, empty values become NaN as with pandas
+                value = float(value) if value != '' else float('nan')
+            except ValueError:
+                # If conversion fails, keep as string
+                pass
+            params[key] = value
+
+    # Adjust parameters based on integration switches
+    if not battery_integration:
+        params['battery_capacity_max'] = 0
+        params['battery_investment_cost'] = 0
+        params['battery_fixed_cost'] = 0
+        params['charge_power_max'] = 0
+        params['discharge_power_max'] = 0
+        params['initial_soc'] = 0
+
+    if not pv_integration:
+        params['pv_capacity'] = 0
+        params['pv_investment_cost'] = 0
+        params['pv_fixed_cost'] = 0
+        params['feed_in_tariff'] = 0
+
     return params
\ No newline at end of file
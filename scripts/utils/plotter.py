@@ -1,163 +1,202 @@
-import matplotlib.pyplot as plt
+import os
 import numpy as np
 
+from scripts.utils.projection import time_axis
+
+
+def minmax_indices(length, max_points, *series):
+    # Indices that keep the shape of long series in at most about max_points points: the series are split into
+    # buckets and the position of the smallest and largest value of every series in every bucket is kept (plus
+    # the first and last point), so peaks survive the downsampling. Several series share the point budget and
+    # get the union of their indices, so stacked areas stay aligned.
+    if length <= max_points:
+        return np.arange(length)
+    buckets = max(1, max_points // (2 * max(1, len(series))))
+    bucket_size = -(-length // buckets)
+    indices = [np.array([0, length - 1])]
+    offsets = np.arange(buckets)[:, None] * bucket_size
+    for values in series:
+        padded = np.pad(np.asarray(values, dtype=float)[:length], (0, buckets * bucket_size - length), constant_values=np.nan).reshape(buckets, bucket_size)
+        valid = ~np.all(np.isnan(padded), axis=1)
+        filled = np.where(np.isnan(padded), np.nanmean(padded[valid]) if valid.any() else 0.0, padded)
+        indices.append((offsets + np.argmin(filled, axis=1)[:, None]).ravel())
+        indices.append((offsets + np.argmax(filled, axis=1)[:, None]).ravel())
+    indices = np.unique(np.concatenate(indices))
+    return indices[indices < length]
+
+
 class Plotter:
-    @staticmethod
-    def plot_results(extended_dates, data_cleaned, soc, charge_from_grid, charge_from_pv, use_pv, use_battery, sell_pv, buy_from_grid, costs_battery, profit_pv, effective_profit_from_purchase, total_profit, soc_range, profit_range, method_label, power_electronics_cost, params):
+    # Plots of one optimization result and of sweep summaries. All series are NumPy arrays (or lists /
+    # CumulativeProjection), windows are given in time steps and series longer than max_points are downsampled
+    # with minmax_indices. With output_dir the figures are rendered without pyplot (no GUI backend needed) and
+    # saved as output_dir/<name>.<file_format>, otherwise they are shown in interactive pyplot windows.
+    def __init__(self, output_dir=None, file_format='png', max_points=2000, dpi=100):
+        self.output_dir = output_dir
+        self.file_format = file_format
+        self.max_points = max_points
+        self.dpi = dpi
+
+    def _figure(self):
+        if self.output_dir is not None:
+            from matplotlib.figure import Figure
+            return Figure(figsize=(12, 6), dpi=self.dpi)
+        import matplotlib.pyplot as plt
         plt.ion()  # Interaktive Plots aktivieren
+        return plt.figure(figsize=(12, 6))
+
+    def _finish(self, fig, name):
+        if self.output_dir is None:
+            import matplotlib.pyplot as plt
+            plt.show()
+            return fig
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f'{name}.{self.file_format}')
+        fig.savefig(path)
+        return path
+
+    def _window(self, dates, window, **series):
+        # Window (start, end) of every series, downsampled with shared indices
+        start, end = window
+        values = {key: np.asarray(values[start:end], dtype=float) for key, values in series.items()}
+        indices = minmax_indices(end - start, self.max_points, *values.values())
+        return dates[start:end][indices], {key: array[indices] for key, array in values.items()}
+
+    def plot_results(self, start, prices, load_profile, results, costs_battery, profit_pv, effective_profit_from_purchase, total_profit, soc_range, profit_range, method_label, params):
+        # start: first time stamp, results: result dict of BatteryOptimization, costs_battery / profit_pv /
+        # effective_profit_from_purchase / total_profit: cumulative series over X years (total_profit already
+        # includes the power electronics costs), soc_range / profit_range: plot windows in time steps.
+        # Returns the saved file paths (or the figures in interactive mode).
+        delta_t = params['delta_t']
+        time_steps = len(prices)
+        soc_range = (max(0, soc_range[0]), min(soc_range[1], time_steps))
+        profit_range = (max(0, profit_range[0]), min(profit_range[1], len(total_profit)))
+        dates = time_axis(start, max(time_steps, profit_range[1]), delta_t)
+        flows = {key: np.asarray(results[key], dtype=float) for key in ('charge_from_grid', 'charge_from_pv', 'use_pv', 'use_battery', 'sell_pv', 'buy_from_grid')}
+        outputs = []
+
+        window_dates, window = self._window(
+            dates, soc_range, prices=prices, load_profile=load_profile, soc=np.asarray(results['soc'], dtype=float)[:time_steps],
+            **{key: flows[key] for key in ('charge_from_grid', 'charge_from_pv', 'use_battery', 'buy_from_grid', 'use_pv')}
+        )
 
         # Erster Plot: SOC und Strompreis
-        fig, ax1 = plt.subplots(figsize=(12, 6))
-
+        fig = self._figure()
+        ax1 = fig.subplots()
         ax1.set_xlabel("Time")
         ax1.set_ylabel("Electricity Prices (EUR/kWh)")
-        ax1.plot(data_cleaned['Datetime'][soc_range[0]:soc_range[1]],
-                 data_cleaned['Price (EUR/kWh)'][soc_range[0]:soc_range[1]],
-                 label="Electricity Prices", color="black", linestyle="--")
-        ax1.tick_params(axis='y')
-
+        ax1.plot(window_dates, window['prices'], label="Electricity Prices", color="black", linestyle="--")
         ax2 = ax1.twinx()
         ax2.set_ylabel("State of Charge (kWh)")
-        ax2.fill_between(data_cleaned['Datetime'][soc_range[0]:soc_range[1]],
-                         0, soc[soc_range[0]:soc_range[1]],
-                         label="SOC", alpha=0.5, color='purple', step='post')
-        ax2.tick_params(axis='y')
-
-        fig.tight_layout()
-        plt.title(f"{method_label} Results: SOC and Electricity Prices")
+        ax2.fill_between(window_dates, 0, window['soc'], label="SOC", alpha=0.5, color='purple', step='post')
+        ax1.set_title(f"{method_label} Results: SOC and Electricity Prices")
         fig.legend()
-        plt.show()
+        fig.tight_layout()
+        outputs.append(self._finish(fig, 'soc_prices'))
 
         # Zweiter Plot: Lade- und Entladeleistungen und Strompreis
-        fig, ax1 = plt.subplots(figsize=(12, 6))
-
+        fig = self._figure()
+        ax1 = fig.subplots()
         ax1.set_xlabel("Time")
         ax1.set_ylabel("Electricity Prices (EUR/kWh)")
-        ax1.plot(data_cleaned['Datetime'][soc_range[0]:soc_range[1]],
-                 data_cleaned['Price (EUR/kWh)'][soc_range[0]:soc_range[1]],
-                 label="Electricity Prices", color="black", linestyle="--")
-        ax1.tick_params(axis='y')
-
+        ax1.plot(window_dates, window['prices'], label="Electricity Prices", color="black", linestyle="--")
         ax2 = ax1.twinx()
         ax2.set_ylabel("Power (kW)")
-
-        ax2.fill_between(data_cleaned['Datetime'][soc_range[0]:soc_range[1]],
-                         0, charge_from_grid[soc_range[0]:soc_range[1]],
-                         label="Charge from Grid", alpha=0.5, color='blue', step='post')
-        ax2.fill_between(data_cleaned['Datetime'][soc_range[0]:soc_range[1]],
-                         charge_from_grid[soc_range[0]:soc_range[1]],
-                         charge_from_grid[soc_range[0]:soc_range[1]] + np.array(charge_from_pv[soc_range[0]:soc_range[1]]),
-                         label="Charge from PV", alpha=0.5, color='yellow', step='post')
-        ax2.fill_between(data_cleaned['Datetime'][soc_range[0]:soc_range[1]],
-                         0, -np.array(use_battery[soc_range[0]:soc_range[1]]),
-                         label="Use Battery", alpha=0.5, color='red', step='post')
-
-        ax2.tick_params(axis='y')
-
-        fig.tight_layout()
-        plt.title(f"{method_label} Results: Charging and Discharging with Electricity Prices")
+        ax2.fill_between(window_dates, 0, window['charge_from_grid'], label="Charge from Grid", alpha=0.5, color='blue', step='post')
+        ax2.fill_between(window_dates, window['charge_from_grid'], window['charge_from_grid'] + window['charge_from_pv'], label="Charge from PV", alpha=0.5, color='yellow', step='post')
+        ax2.fill_between(window_dates, 0, -window['use_battery'], label="Use Battery", alpha=0.5, color='red', step='post')
+        ax1.set_title(f"{method_label} Results: Charging and Discharging with Electricity Prices")
         fig.legend()
-        plt.show()
+        fig.tight_layout()
+        outputs.append(self._finish(fig, 'charging_prices'))
 
         # Dritter Plot: Normiertes Lastprofil und relevante Leistungen
-        fig, ax = plt.subplots(figsize=(12, 6))
-
+        fig = self._figure()
+        ax = fig.subplots()
         ax.set_xlabel("Time")
         ax.set_ylabel("Power (kW)")
-
-        ax.plot(data_cleaned['Datetime'][soc_range[0]:soc_range[1]],
-                data_cleaned['Load Profile (kWh)'][soc_range[0]:soc_range[1]],
-                label="Normalized Load Profile", color="black", linestyle="--")
-
-        ax.fill_between(data_cleaned['Datetime'][soc_range[0]:soc_range[1]],
-                        0, buy_from_grid[soc_range[0]:soc_range[1]],
-                        label="Buy from Grid", alpha=0.5, color='cyan', step='post')
-        ax.fill_between(data_cleaned['Datetime'][soc_range[0]:soc_range[1]],
-                        buy_from_grid[soc_range[0]:soc_range[1]],
-                        buy_from_grid[soc_range[0]:soc_range[1]] + np.array(use_battery[soc_range[0]:soc_range[1]]),
-                        label="Use Battery", alpha=0.5, color='red', step='post')
-        ax.fill_between(data_cleaned['Datetime'][soc_range[0]:soc_range[1]],
-                        buy_from_grid[soc_range[0]:soc_range[1]] + np.array(use_battery[soc_range[0]:soc_range[1]]),
-                        buy_from_grid[soc_range[0]:soc_range[1]] + np.array(use_battery[soc_range[0]:soc_range[1]]) + np.array(use_pv[soc_range[0]:soc_range[1]]),
-                        label="Use PV", alpha=0.5, color='orange', step='post')
-
-        ax.tick_params(axis='y')
-
-        fig.tight_layout()
-        plt.title(f"{method_label} Results: Normalized Load Profile and Relevant Power Flows")
+        ax.plot(window_dates, window['load_profile'], label="Normalized Load Profile", color="black", linestyle="--")
+        grid_and_battery = window['buy_from_grid'] + window['use_battery']
+        ax.fill_between(window_dates, 0, window['buy_from_grid'], label="Buy from Grid", alpha=0.5, color='cyan', step='post')
+        ax.fill_between(window_dates, window['buy_from_grid'], grid_and_battery, label="Use Battery", alpha=0.5, color='red', step='post')
+        ax.fill_between(window_dates, grid_and_battery, grid_and_battery + window['use_pv'], label="Use PV", alpha=0.5, color='orange', step='post')
+        ax.set_title(f"{method_label} Results: Normalized Load Profile and Relevant Power Flows")
         fig.legend()
-        plt.show()
+        fig.tight_layout()
+        outputs.append(self._finish(fig, 'load_flows'))
 
         # Vierter Plot: Kumulierte Gewinne
-        fig, ax = plt.subplots(figsize=(12, 6))
-        ax.plot(extended_dates[profit_range[0]:profit_range[1]],
-                costs_battery[profit_range[0]:profit_range[1]],
-                label="Cumulative Costs from Battery", color='blue')
-        ax.plot(extended_dates[profit_range[0]:profit_range[1]],
-                profit_pv[profit_range[0]:profit_range[1]],
-                label="Cumulative Profit from PV", color='green')
-        ax.plot(extended_dates[profit_range[0]:profit_range[1]],
-                effective_profit_from_purchase[profit_range[0]:profit_range[1]],
-                label="Effective Profit from Purchase", color='orange')
-
-        # Berechnung des totalen kumulierten Profits
-        total_cumulative_profit = np.array(total_profit) - power_electronics_cost
-
-        ax.plot(extended_dates[profit_range[0]:profit_range[1]],
-                total_cumulative_profit[profit_range[0]:profit_range[1]],
-                label="Total Cumulative Profit", color='black', linestyle='--')
-
-        # Zahlen für den jeweils letzten abgebildeten Wert
-        ax.text(extended_dates[profit_range[1]-1], costs_battery[profit_range[1]-1], f'{costs_battery[profit_range[1]-1]:.2f}', color='blue')
-        ax.text(extended_dates[profit_range[1]-1], profit_pv[profit_range[1]-1], f'{profit_pv[profit_range[1]-1]:.2f}', color='green')
-        ax.text(extended_dates[profit_range[1]-1], effective_profit_from_purchase[profit_range[1]-1], f'{effective_profit_from_purchase[profit_range[1]-1]:.2f}', color='orange')
-        ax.text(extended_dates[profit_range[1]-1], total_cumulative_profit[profit_range[1]-1], f'{total_cumulative_profit[profit_range[1]-1]:.2f}', color='black')
+        profit_dates, profits = self._window(
+            dates, profit_range, costs_battery=costs_battery, profit_pv=profit_pv,
+            effective_profit_from_purchase=effective_profit_from_purchase, total_profit=total_profit
+        )
+        fig = self._figure()
+        ax = fig.subplots()
+        lines = [
+            ('costs_battery', "Cumulative Costs from Battery", 'blue', '-'),
+            ('profit_pv', "Cumulative Profit from PV", 'green', '-'),
+            ('effective_profit_from_purchase', "Effective Profit from Purchase", 'orange', '-'),
+            ('total_profit', "Total Cumulative Profit", 'black', '--'),
+        ]
+        for key, label, color, linestyle in lines:
+            ax.plot(profit_dates, profits[key], label=label, color=color, linestyle=linestyle)
+            # Zahlen für den jeweils letzten abgebildeten Wert
+            ax.text(profit_dates[-1], profits[key][-1], f'{profits[key][-1]:.2f}', color=color)
 
         # Flächen unter der Kurve einfärben
-        ax.fill_between(extended_dates[profit_range[0]:profit_range[1]], total_cumulative_profit[profit_range[0]:profit_range[1]], where=(total_cumulative_profit[profit_range[0]:profit_range[1]] < 0), color='red', alpha=0.3, interpolate=True)
-        ax.fill_between(extended_dates[profit_range[0]:profit_range[1]], total_cumulative_profit[profit_range[0]:profit_range[1]], where=(total_cumulative_profit[profit_range[0]:profit_range[1]] >= 0), color='green', alpha=0.3, interpolate=True)
-
+        total = profits['total_profit']
+        ax.fill_between(profit_dates, total, where=total < 0, color='red', alpha=0.3, interpolate=True)
+        ax.fill_between(profit_dates, total, where=total >= 0, color='green', alpha=0.3, interpolate=True)
         ax.set_xlabel("Time")
         ax.set_ylabel("Cumulative Profit (EUR)")
+        ax.set_title(f"{method_label} Results: Cumulative Profit")
         ax.legend()
         ax.grid(True)
-        plt.title(f"{method_label} Results: Cumulative Profit")
-        plt.show()
-
-        # Vierter Plot: Kumulierte Leistungen als Balkendiagramm
-        fig, ax = plt.subplots(figsize=(12, 6))
-        cumulative_charge_from_grid = np.sum(charge_from_grid[profit_range[0]:profit_range[1]])
-        cumulative_buy_from_grid = np.sum(buy_from_grid[profit_range[0]:profit_range[1]])
-        cumulative_charge_from_pv = np.sum(charge_from_pv[profit_range[0]:profit_range[1]])
-        cumulative_use_pv = np.sum(use_pv[profit_range[0]:profit_range[1]])
-        cumulative_use_battery = np.sum(use_battery[profit_range[0]:profit_range[1]])
-        cumulative_sell_pv = np.sum(sell_pv[profit_range[0]:profit_range[1]])
+        outputs.append(self._finish(fig, 'cumulative_profit'))
 
+        # Fünfter Plot: Jährliche Energiemengen als Balkendiagramm
+        fig = self._figure()
+        ax = fig.subplots()
         labels = ['Charge from Grid', 'Charge from PV', 'Use Battery', 'Sell PV', 'Use PV', 'Buy from Grid']
-        values = [
-            cumulative_charge_from_grid,
-            cumulative_charge_from_pv,
-            cumulative_use_battery,
-            cumulative_sell_pv,
-            cumulative_use_pv,
-            cumulative_buy_from_grid
-        ]
+        keys = ['charge_from_grid', 'charge_from_pv', 'use_battery', 'sell_pv', 'use_pv', 'buy_from_grid']
         colors = ['blue', 'yellow', 'red', 'green', 'orange', 'cyan']
-
-        bars = ax.bar(labels, values, color=colors)
-
-        # Werte innerhalb der farbigen Flächen anzeigen
-        for bar in bars:
-            height = bar.get_height()
-            ax.annotate(f'{height:.2f}',
-                        xy=(bar.get_x() + bar.get_width() / 2, height),
-                        xytext=(0, 3),  # 3 points vertical offset
-                        textcoords="offset points",
-                        ha='center', va='bottom')
-
+        bars = ax.bar(labels, [np.sum(flows[key]) * delta_t for key in keys], color=colors)
+        ax.bar_label(bars, fmt='%.2f', padding=3)
         ax.set_xlabel("Power Source")
-        ax.set_ylabel("Cumulative Power (kW)")
-        ax.set_title(f"{method_label} Results: Cumulative Power")
-        ax.legend()
+        ax.set_ylabel("Annual Energy (kWh)")
+        ax.set_title(f"{method_label} Results: Annual Energy")
+        ax.grid(True)
+        outputs.append(self._finish(fig, 'annual_energy'))
+
+        return outputs
+
+    def plot_sweep(self, summary, x, y='total_profit', group=None, name=None):
+        # Line chart of a sweep summary (DataFrame of run_sweep), one line per value of group
+        fig = self._figure()
+        ax = fig.subplots()
+        groups = [(None, summary)] if group is None else summary.groupby(group)
+        for value, rows in groups:
+            rows = rows.sort_values(x)
+            ax.plot(rows[x].to_numpy(), rows[y].to_numpy(), marker='o', label=None if group is None else f"{group} = {value}")
+        ax.set_xlabel(x)
+        ax.set_ylabel(y)
+        ax.set_title(f"Sweep: {y} over {x}")
+        if group is not None:
+            ax.legend()
         ax.grid(True)
-        plt.show()
+        return self._finish(fig, name or f'sweep_{y}_{x}')
+
+    def plot_sweep_heatmap(self, summary, x, y, value='total_profit', name=None):
+        # Heat map of value over two swept parameters (mean over the other parameters)
+        table = summary.pivot_table(index=y, columns=x, values=value, aggfunc='mean')
+        fig = self._figure()
+        ax = fig.subplots()
+        image = ax.imshow(table.to_numpy(), origin='lower', aspect='auto', cmap='viridis')
+        ax.set_xticks(np.arange(len(table.columns)), [f'{column:g}' for column in table.columns])
+        ax.set_yticks(np.arange(len(table.index)), [f'{index:g}' for index in table.index])
+        for (row, column), cell in np.ndenumerate(table.to_numpy()):
+            ax.text(column, row, f'{cell:.0f}', ha='center', va='center', color='white')
+        fig.colorbar(image, ax=ax, label=value)
+        ax.set_xlabel(x)
+        ax.set_ylabel(y)
+        ax.set_title(f"Sweep: {value}")
+        return self._finish(fig, name or f'sweep_{value}_{x}_{y}')
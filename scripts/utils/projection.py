@@ -0,0 +1,88 @@
+import numpy as np
+
+
+def time_axis(start, time_steps, delta_t):
+    # Time stamps of time_steps steps of delta_t hours from start (anything numpy.datetime64 accepts)
+    return np.datetime64(start, 's') + (np.arange(time_steps) * delta_t * 3600).astype('timedelta64[s]')
+
+
+def discount_factors(params, X):
+    # Present value factor of each operating year, the first year is not discounted
+    return ((1 + params['inflation_rate']) / (1 + params['interest_rate'])) ** np.arange(X)
+
+
+class CumulativeProjection:
+    # Cumulative cash flow of one year (in_year, per time step) repeated for len(year_factors) years:
+    #   value[k * T + t] = offset + sum_{j < k} year_factors[j] * in_year[-1] + year_factors[k] * in_year[t]
+    # Nothing of length T * X is stored, values are computed on indexing / slicing and the full series is only
+    # built by np.asarray(projection). Projections with the same years can be added and shifted by constants.
+    # in_year may also hold one cumulative series per year (shape (years, T)), e.g. if every year is dispatched
+    # with a faded battery capacity, in_year[k] then replaces in_year in year k.
+    __slots__ = ('in_year', 'year_factors', 'offset')
+
+    def __init__(self, in_year, year_factors, offset=0.0):
+        self.in_year = np.asarray(in_year, dtype=float)
+        self.year_factors = np.asarray(year_factors, dtype=float)
+        self.offset = offset
+
+    @property
+    def steps_per_year(self):
+        return self.in_year.shape[-1]
+
+    @property
+    def years(self):
+        return len(self.year_factors)
+
+    def year_start(self):
+        # Cumulative value carried into each year
+        annual_totals = self.year_factors * (self.in_year[..., -1] if self.steps_per_year else 0.0)
+        return self.offset + np.concatenate(([0.0], np.cumsum(annual_totals)[:-1]))
+
+    def annual(self):
+        # Cumulative value at the end of each year
+        return self.year_start() + self.year_factors * (self.in_year[..., -1] if self.steps_per_year else 0.0)
+
+    @property
+    def final(self):
+        # Value at the end of the horizon, i.e. the net present value if the year factors discount
+        return self.annual()[-1] if self.years else self.offset
+
+    def __len__(self):
+        return self.steps_per_year * self.years
+
+    def __getitem__(self, index):
+        positions = np.arange(len(self))[index]
+        year, step = np.divmod(positions, self.steps_per_year)
+        in_year = self.in_year[year, step] if self.in_year.ndim == 2 else self.in_year[step]
+        return self.year_start()[year] + self.year_factors[year] * in_year
+
+    def __array__(self, dtype=None, copy=None):
+        series = (self.year_start()[:, None] + self.year_factors[:, None] * self.in_year.reshape(-1, self.steps_per_year)).ravel()
+        return series if dtype is None else series.astype(dtype)
+
+    def _shifted(self, constant):
+        return CumulativeProjection(self.in_year, self.year_factors, self.offset + constant)
+
+    def __add__(self, other):
+        if isinstance(other, CumulativeProjection):
+            if self.steps_per_year != other.steps_per_year or not np.array_equal(self.year_factors, other.year_factors):
+                raise ValueError("Projections must cover the same time steps and years")
+            return CumulativeProjection(self.in_year + other.in_year, self.year_factors, self.offset + other.offset)
+        return self._shifted(other)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return CumulativeProjection(-self.in_year, self.year_factors, -self.offset)
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __rsub__(self, other):
+        return (-self) + other
+
+
+def project_cumulative(in_year, X=1, year_factors=None, offset=0.0):
+    if year_factors is None:
+        year_factors = np.ones(X)
+    return CumulativeProjection(in_year, year_factors, offset)
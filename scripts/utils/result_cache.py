@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+from scripts.utils.data_cache import CACHE_DIR
+from scripts.optimizations.results import DispatchResults
+
+RESULT_CACHE_DIR = os.path.join(CACHE_DIR, 'results')
+# Bump when a change of the optimizers alters their results, so old entries are no longer hit
+CACHE_VERSION = 4
+# params entries the dispatch depends on, costs / interest rates only enter the profit calculation and the
+# annual consumption is already contained in the normalized load profile
+DISPATCH_PARAMS = (
+    'delta_t', 'battery_capacity_max', 'battery_capacity_min', 'charge_power_max', 'discharge_power_max',
+    'efficiency', 'initial_soc', 'pv_capacity', 'feed_in_tariff', 'grid_power_max', 'reference_fixed_price',
+    'soc_levels', 'block_hours', 'cycle_cost',
+)
+
+
+class ResultCache:
+    # Content-addressed on-disk cache of BatteryOptimization results. The key hashes the input arrays, the
+    # dispatch relevant params entries and the optimizer settings, an entry is one .npz file. Every hit refreshes
+    # the entry's modification time, and after every store the least recently used entries are deleted until the
+    # cache is at most max_bytes large. Results of optimizations with a failed solve are not stored.
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(optimizer):
+        digest = hashlib.sha1()
+        series = [optimizer.prices, optimizer.pv_output, optimizer.load_profile]
+        if optimizer.tariff is not None:
+            series += [optimizer.tariff.sell, optimizer.tariff.periods, [optimizer.tariff.peak_charge]]
+        for values in series:
+            digest.update(np.ascontiguousarray(values, dtype=float).tobytes())
+            digest.update(b'|')
+        settings = {
+            'version': CACHE_VERSION,
+            'params': {key: optimizer.params.get(key) for key in DISPATCH_PARAMS},
+            'optimization_type': optimizer.optimization_type,
+            'fixed_purchase_price': bool(optimizer.fixed_purchase_price),
+            'backend': optimizer.backend,
+            'horizon_steps': optimizer.horizon_steps,
+            'commit_steps': optimizer.commit_steps,
+        }
+        digest.update(json.dumps(settings, sort_keys=True, default=float).encode('utf-8'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with np.load(path) as entry:
+                results = DispatchResults(entry['flows'], entry['soc'])
+            os.utime(path)  # Mark as recently used
+        except (OSError, ValueError, KeyError):
+            return None  # Missing, evicted by another process in the meantime or unreadable
+        return results
+
+    def put(self, key, results):
+        # results: DispatchResults
+        # Write to a temporary file first so concurrent workers never read a half-written entry
+        os.makedirs(self.cache_dir, exist_ok=True)
+        file_descriptor, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'wb') as file:
+            np.savez(file, flows=results.flows, soc=results.soc)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total -= size
+
+    def optimize(self, optimizer):
+        # optimizer.optimize() unless the same dispatch problem was solved before
+        key = self.key(optimizer)
+        results = self.get(key)
+        if results is not None:
+            self.hits += 1
+            results.timestamps = optimizer.timestamps
+            return results
+        self.misses += 1
+        failed = len(optimizer.telemetry.failed)
+        results = optimizer.optimize()
+        if len(optimizer.telemetry.failed) == failed:  # Results with failed solves are not stored
+            self.put(key, results)
+        return results
@@ -0,0 +1,134 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Result keys and the column names used in the exported files
+COLUMNS = [
+    ('soc', 'SOC'),
+    ('prices', 'Price (EUR/kWh)'),
+    ('charge_from_grid', 'Charge from Grid'),
+    ('charge_from_pv', 'Charge from PV'),
+    ('use_battery', 'Use Battery'),
+    ('use_pv', 'Use PV'),
+    ('sell_pv', 'Sell PV'),
+    ('buy_from_grid', 'Buy from Grid'),
+    ('load_profile', 'Normalized Load Profile'),
+    ('total_profit', 'Total Profit'),
+]
+EXTENSIONS = {'parquet': '.parquet', 'feather': '.feather', 'csv': '.csv'}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet and Feather export require pyarrow, use file_format='csv' without it")
+    return pyarrow
+
+
+class ResultsWriter:
+    # Writes optimizer results (DispatchResults or a dict of arrays) as one row per time step to Parquet, Feather
+    # (both via pyarrow) or CSV. write() stores a complete result set, append() adds chunks (e.g. committed
+    # rolling-horizon windows) to an open file until close(). A scenario dict partitions the output as output_dir/key=value/.../file_name.
+    def __init__(self, output_dir, file_format='parquet', file_name='results_timeseries'):
+        if file_format not in EXTENSIONS:
+            raise ValueError("Invalid file format")
+        if file_format != 'csv':
+            _require_pyarrow()
+        self.output_dir = output_dir
+        self.file_format = file_format
+        self.file_name = file_name
+        self._writers = {}  # path -> open pyarrow writer or CSV file handle of append()
+        self._schemas = {}
+
+    def path(self, scenario=None):
+        directory = self.output_dir
+        for key, value in (scenario or {}).items():
+            directory = os.path.join(directory, f'{key}={value}')
+        return os.path.join(directory, self.file_name + EXTENSIONS[self.file_format])
+
+    @staticmethod
+    def columns(results, timestamps=None, prices=None, load_profile=None, total_profit=None, start=0):
+        # Column arrays of the result set, results['soc'] may include the initial SOC (time_steps + 1 values).
+        # Without timestamps those of a DispatchResults are used (they start at its first step).
+        time_steps = len(results['charge_from_grid'])
+        soc = np.asarray(results['soc'], dtype=float)
+        series = {key: np.asarray(results[key], dtype=float) for key in results if key != 'soc'}
+        series['soc'] = soc[1:] if len(soc) == time_steps + 1 else soc
+        for key, values in (('prices', prices), ('load_profile', load_profile), ('total_profit', total_profit)):
+            if values is not None:
+                series[key] = np.asarray(values[start:start + time_steps], dtype=float)
+
+        columns = {}
+        if timestamps is not None:
+            columns['Datetime'] = pd.to_datetime(np.asarray(timestamps)[start:start + time_steps], utc=True)
+        elif getattr(results, 'timestamps', None) is not None:
+            columns['Datetime'] = pd.to_datetime(np.asarray(results.timestamps), utc=True)
+        else:
+            columns['Step'] = np.arange(start, start + time_steps)
+        columns.update({name: series[key] for key, name in COLUMNS if key in series})
+        return columns
+
+    def write(self, results, timestamps=None, prices=None, load_profile=None, total_profit=None, scenario=None):
+        path = self.path(scenario)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        columns = self.columns(results, timestamps, prices, load_profile, total_profit)
+
+        if self.file_format == 'csv':
+            pd.DataFrame(columns).to_csv(path, index=False)
+        else:
+            pyarrow = _require_pyarrow()
+            table = pyarrow.table(columns)
+            if self.file_format == 'parquet':
+                import pyarrow.parquet
+                pyarrow.parquet.write_table(table, path)
+            else:
+                import pyarrow.feather
+                pyarrow.feather.write_feather(table, path)
+        return path
+
+    def append(self, results, timestamps=None, prices=None, load_profile=None, total_profit=None, scenario=None, start=0):
+        # start is the index of the chunk's first time step in timestamps / prices / load_profile / total_profit
+        path = self.path(scenario)
+        columns = self.columns(results, timestamps, prices, load_profile, total_profit, start)
+
+        if path not in self._writers:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            if self.file_format == 'csv':
+                self._writers[path] = open(path, 'w', newline='')
+                pd.DataFrame(columns).to_csv(self._writers[path], index=False)
+                return path
+            pyarrow = _require_pyarrow()
+            schema = self._schemas[path] = pyarrow.table(columns).schema
+            if self.file_format == 'parquet':
+                import pyarrow.parquet
+                self._writers[path] = pyarrow.parquet.ParquetWriter(path, schema)
+            else:
+                import pyarrow.ipc
+                self._writers[path] = pyarrow.ipc.new_file(path, schema)  # Feather v2 is the Arrow IPC file format
+
+        writer = self._writers[path]
+        if self.file_format == 'csv':
+            pd.DataFrame(columns).to_csv(writer, index=False, header=False)
+        else:
+            writer.write_table(_require_pyarrow().table(columns, schema=self._schemas[path]))
+        return path
+
+    def on_commit(self, timestamps=None, prices=None, load_profile=None, scenario=None):
+        # Callback (start, chunk) of BatteryOptimization / RollingHorizon.run that appends every committed window,
+        # timestamps / prices / load_profile cover the whole run
+        def append(start, chunk):
+            self.append(chunk, timestamps, prices, load_profile, scenario=scenario, start=start)
+        return append
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        self._schemas = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
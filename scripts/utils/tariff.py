@@ -0,0 +1,100 @@
+import numpy as np
+
+from scripts.utils.projection import time_axis
+
+
+def local_start(timestamps):
+    # Local wall-clock time of the first step (numpy.datetime64), the time-of-use bands and billing periods are
+    # laid out from it in steps of delta_t
+    import pandas as pd
+    return pd.Timestamp(str(timestamps[0])).tz_localize(None).to_datetime64()
+
+
+class TariffSeries:
+    # Per-step prices of a Tariff for one input year, computed once and shared by every optimization of it:
+    #   buy, sell:   EUR/kWh of grid imports (charge_from_grid + buy_from_grid) and of sell_pv
+    #   periods:     billing period of every step, 0, 1, ... in order
+    #   peak_charge: EUR per kW of the highest grid import of each billing period
+    __slots__ = ('buy', 'sell', 'periods', 'peak_charge')
+
+    def __init__(self, buy, sell, periods, peak_charge=0.0):
+        self.buy = buy
+        self.sell = sell
+        self.periods = periods
+        self.peak_charge = peak_charge
+
+    @property
+    def num_periods(self):
+        return int(self.periods[-1]) + 1 if len(self.periods) else 0
+
+    @property
+    def has_peak_charge(self):
+        return self.peak_charge != 0
+
+    @property
+    def constant_sell(self):
+        return bool(np.all(self.sell == self.sell[0]))
+
+    def period_starts(self):
+        return np.flatnonzero(np.diff(self.periods, prepend=-1))
+
+    def peak_demand(self, grid_import):
+        # Highest grid import (kW) of every billing period, along the last axis
+        return np.maximum.reduceat(np.asarray(grid_import, dtype=float), self.period_starts(), axis=-1)
+
+    def peak_cost(self, grid_import):
+        # Peak-demand charge of every step, booked at the last step of its billing period
+        peak_demand = self.peak_demand(grid_import)
+        cost = np.zeros(peak_demand.shape[:-1] + (len(self.periods),))
+        cost[..., np.append(self.period_starts()[1:], len(self.periods)) - 1] = self.peak_charge * peak_demand
+        return cost
+
+
+class Tariff:
+    # End-user tariff composed from the spot price (EUR/kWh, see normalize_data(price_scaling='eur_per_kwh')):
+    #   buy  = (spot_factor * spot + energy_price + grid_fee + time-of-use surcharge + tax) * (1 + vat)
+    #   sell = feed_in_tariff + sell_spot_factor * spot
+    # tou_bands: (start_hour, end_hour, surcharge EUR/kWh[, weekdays]) bands of local time, end_hour < start_hour
+    # wraps past midnight, weekdays (0 = Monday) restricts a band to these days. peak_charge (EUR/kW) is charged
+    # on the highest grid import of every billing period, a numpy datetime unit ('M' months, 'D' days, 'Y' years).
+    # feed_in_tariff=None takes params['feed_in_tariff'].
+    def __init__(self, spot_factor=1.0, energy_price=0.0, grid_fee=0.0, tax=0.0, vat=0.0, tou_bands=(),
+                 feed_in_tariff=None, sell_spot_factor=0.0, peak_charge=0.0, billing_period='M'):
+        self.spot_factor = spot_factor
+        self.energy_price = energy_price
+        self.grid_fee = grid_fee
+        self.tax = tax
+        self.vat = vat
+        self.tou_bands = [tuple(band) for band in tou_bands]
+        self.feed_in_tariff = feed_in_tariff
+        self.sell_spot_factor = sell_spot_factor
+        self.peak_charge = peak_charge
+        self.billing_period = billing_period
+
+    def tou_surcharge(self, dates):
+        hours = (dates - dates.astype('datetime64[D]')) / np.timedelta64(1, 'h')
+        weekdays = (dates.astype('datetime64[D]').astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+        surcharge = np.zeros(len(dates))
+        for band in self.tou_bands:
+            start_hour, end_hour, value = band[:3]
+            if start_hour <= end_hour:
+                active = (hours >= start_hour) & (hours < end_hour)
+            else:
+                active = (hours >= start_hour) | (hours < end_hour)
+            if len(band) > 3:
+                active &= np.isin(weekdays, band[3])
+            surcharge[active] += value
+        return surcharge
+
+    def billing_periods(self, dates):
+        periods = dates.astype(f'datetime64[{self.billing_period}]').astype(np.int64)
+        return periods - periods[0] if len(periods) else periods
+
+    def series(self, spot_prices, start, params):
+        # TariffSeries of spot_prices (EUR/kWh per step), start: local time of the first step (see local_start)
+        spot = np.asarray(spot_prices, dtype=float)
+        dates = time_axis(start, len(spot), params['delta_t'])
+        buy = (self.spot_factor * spot + self.energy_price + self.grid_fee + self.tou_surcharge(dates) + self.tax) * (1 + self.vat)
+        feed_in_tariff = params['feed_in_tariff'] if self.feed_in_tariff is None else self.feed_in_tariff
+        sell = feed_in_tariff + self.sell_spot_factor * spot
+        return TariffSeries(buy, sell, self.billing_periods(dates), float(self.peak_charge))